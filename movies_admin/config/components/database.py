@@ -13,3 +13,6 @@ DATABASES = {
     }
 }
 
+
+# Тестовая база создаётся пустой, схему content для неё создаёт этот запуск тестов
+TEST_RUNNER = 'config.test_runner.ContentSchemaTestRunner'
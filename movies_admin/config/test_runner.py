@@ -0,0 +1,27 @@
+from django.db.backends.base.base import NO_DB_ALIAS
+from django.db.backends.signals import connection_created
+from django.test.runner import DiscoverRunner
+
+
+def create_content_schema(sender, connection, **kwargs):
+    # Служебное соединение с базой postgres, через которое создаётся тестовая база, пропускается
+    if connection.alias == NO_DB_ALIAS or connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('CREATE SCHEMA IF NOT EXISTS content')
+
+
+class ContentSchemaTestRunner(DiscoverRunner):
+    """Запуск тестов на пустом кластере Postgres
+
+    Таблицы моделей лежат в схеме content, которую создаёт SQL из первого задания,
+    а не миграции. Пока готовятся тестовые базы, схема создаётся при каждом
+    новом соединении, то есть до миграций каждой тестовой базы.
+    """
+
+    def setup_databases(self, **kwargs):
+        connection_created.connect(create_content_schema)
+        try:
+            return super().setup_databases(**kwargs)
+        finally:
+            connection_created.disconnect(create_content_schema)
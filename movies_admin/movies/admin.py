@@ -1,63 +1,118 @@
+import uuid
+
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
+from django.contrib.postgres.aggregates import StringAgg
+from django.db.models import Case, F, OuterRef, Subquery, TextField, Value, When
+from django.db.models.functions import Concat
+from .autocomplete import PrefixAutocompleteInlineMixin, PrefixAutocompleteMixin
+from .inlines import PagedInlineMixin
 from .models import Genre, FilmWork, GenreFilmWork, Person, PersonFilmWork
+from .paginator import EstimatedCountMixin
 from django.utils.translation import gettext_lazy as _
 
 
+class IndexedSearchMixin:
+    """Поиск по search_fields идёт через триграммные индексы, а uuid ищется точным совпадением по ключу
+
+    id в search_fields не добавляется: icontains по id::text не использует индексы
+    и превращает весь поиск в последовательное чтение таблицы.
+    """
+
+    def get_search_results(self, request, queryset, search_term):
+        try:
+            pk = uuid.UUID(search_term.strip())
+        except ValueError:
+            return super().get_search_results(request, queryset, search_term)
+        return queryset.filter(pk=pk), False
+
+
+class FilmWorkChangeList(ChangeList):
+    def get_queryset(self, request, exclude_parameters=None):
+        return self.model_admin.annotate_lists(super().get_queryset(request, exclude_parameters))
+
+
 # Register your models here.
 @admin.register(Genre)
-class GenreAdmin(admin.ModelAdmin):
+class GenreAdmin(PrefixAutocompleteMixin, EstimatedCountMixin, admin.ModelAdmin):
     search_fields = ['name']
+    # Жанров единицы, отдельный индекс для автодополнения не нужен
+    autocomplete_field = 'name'
 
 
 @admin.register(Person)
-class PersonAdmin(admin.ModelAdmin):
+class PersonAdmin(PrefixAutocompleteMixin, IndexedSearchMixin, EstimatedCountMixin, admin.ModelAdmin):
     search_fields = ['full_name']
+    autocomplete_field = 'full_name'
 
 
-class GenreFilmWorkInline(admin.TabularInline):
+class GenreFilmWorkInline(PrefixAutocompleteInlineMixin, admin.TabularInline):
     model = GenreFilmWork
     autocomplete_fields = ['genre']
 
 
-class PersonFilmWorkInline(admin.TabularInline):
+class PersonFilmWorkInline(PagedInlineMixin, PrefixAutocompleteInlineMixin, admin.TabularInline):
     model = PersonFilmWork
     autocomplete_fields = ['person']
+    # Состав фильма выводится страницами, персоны приходят одним запросом со связями
+    select_related = ('person',)
+    ordering = ('role', 'person__full_name', 'id')
 
 
 @admin.register(FilmWork)
-class FilmWorkAdmin(admin.ModelAdmin):
+class FilmWorkAdmin(IndexedSearchMixin, EstimatedCountMixin, admin.ModelAdmin):
     inlines = (GenreFilmWorkInline, PersonFilmWorkInline,)
     # Отображение полей в списке
     list_display = ('title', 'type', 'creation_date', 'rating', 'get_genres', 'get_persons')
     # Фильтрация в списке
     list_filter = ('type',)
     # Поиск по полям
-    search_fields = ('title', 'description', 'id')
-    #
-    list_prefetch_related = ('genres', 'persons')
-
-    def get_queryset(self, request):
-        queryset = (
-            super()
-            .get_queryset(request)
-            .prefetch_related(*self.list_prefetch_related)
+    search_fields = ('title', 'description')
+
+    @staticmethod
+    def role_display():
+        """Название роли на текущем языке, подставляется прямо в SQL"""
+        return Case(
+            *[When(role=value, then=Value(str(label))) for value, label in PersonFilmWork.Roles.choices],
+            default=F('role'),
+            output_field=TextField(),
+        )
+
+    def get_changelist(self, request, **kwargs):
+        return FilmWorkChangeList
+
+    def annotate_lists(self, queryset):
+        # Жанры и участники собираются в строки коррелированными подзапросами:
+        # число запросов на страницу не зависит от размера состава фильмов.
+        # Только для списка: форме изменения и удалению эти строки не нужны
+        genres = (
+            GenreFilmWork.objects
+            .filter(film_work=OuterRef('pk'))
+            .values('film_work')
+            .annotate(names=StringAgg('genre__name', ', ', order_by='genre__name'))
+            .values('names')
+        )
+        persons = (
+            PersonFilmWork.objects
+            .filter(film_work=OuterRef('pk'))
+            .values('film_work')
+            .annotate(names=StringAgg(
+                Concat('person__full_name', Value(' ('), self.role_display(), Value(')'), output_field=TextField()),
+                ', ',
+                order_by=('role', 'person__full_name'),
+            ))
+            .values('names')
+        )
+        return queryset.annotate(
+            genres_list=Subquery(genres, output_field=TextField()),
+            persons_list=Subquery(persons, output_field=TextField()),
         )
-        return queryset
 
     def get_genres(self, obj):
-        return ', '.join([genre.name for genre in obj.genres.all()])
+        return obj.genres_list or ''
 
     def get_persons(self, obj):
-        persons_with_roles = []
-        # Для локализацтт ролей
-        roles_by_person = {}
-        for person_film_work in obj.personfilmwork_set.all():
-            roles_by_person[person_film_work.person_id] = person_film_work.get_role_display()
-        for person in obj.persons.all():
-            role = roles_by_person.get(person.id, _('undefined'))
-            persons_with_roles.append(f"{person.full_name} ({role})")
-
-        return ', '.join(persons_with_roles)
+        return obj.persons_list or ''
 
     get_genres.short_description = _('Film genres')
     get_persons.short_description = _('Persons with roles')
@@ -0,0 +1,111 @@
+import hashlib
+
+from django.contrib.admin.views.autocomplete import AutocompleteJsonView
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+from django.http import JsonResponse
+from django.urls import path, reverse
+
+from .models import prefix_key
+
+# Сколько секунд ответ на один и тот же ввод берётся из кэша
+CACHE_TIMEOUT = 30
+PAGE_SIZE = 20
+
+
+class PrefixAutocompleteJsonView(AutocompleteJsonView):
+    """Автодополнение по началу строки без подсчёта общего числа строк
+
+    Строки ищутся по индексу prefix_key в порядке этого же индекса, поэтому
+    запрос читает не больше страницы строк при любом размере таблицы.
+    Есть ли следующая страница, определяет одна лишняя строка вместо COUNT(*).
+    Ответ кэшируется по модели, полю, вводу и странице.
+    """
+
+    def get(self, request, *args, **kwargs):
+        self.term, self.model_admin, self.source_field, to_field_name = self.process_request(request)
+        if not self.has_perm(request):
+            raise PermissionDenied
+        try:
+            page = max(int(request.GET.get('page', 1)), 1)
+        except ValueError:
+            page = 1
+        term = self.term.strip().upper()
+        cache_key = 'autocomplete:{}:{}:{}:{}'.format(
+            self.source_field.remote_field.model._meta.label_lower,
+            to_field_name,
+            page,
+            hashlib.md5(term.encode()).hexdigest(),
+        )
+        data = cache.get(cache_key)
+        if data is None:
+            data = self.lookup(term, page, to_field_name)
+            cache.set(cache_key, data, CACHE_TIMEOUT)
+        return JsonResponse(data)
+
+    def lookup(self, term: str, page: int, to_field_name: str) -> dict:
+        offset = (page - 1) * PAGE_SIZE
+        queryset = (
+            self.model_admin.get_queryset(self.request)
+            .complex_filter(self.source_field.get_limit_choices_to())
+            .annotate(search_key=prefix_key(self.model_admin.autocomplete_field))
+            .filter(search_key__startswith=term)
+            .order_by('search_key', 'pk')
+        )
+        rows = list(queryset[offset:offset + PAGE_SIZE + 1])
+        return {
+            'results': [self.serialize_result(x, to_field_name) for x in rows[:PAGE_SIZE]],
+            'pagination': {'more': len(rows) > PAGE_SIZE},
+        }
+
+
+class PrefixAutocompleteSelect(AutocompleteSelect):
+    """Виджет автодополнения, который обращается к PrefixAutocompleteJsonView связанной модели
+
+    known_objects - уже загруженные связанные объекты. Если выбранное значение
+    среди них, подпись берётся из объекта без запроса к базе.
+    """
+    known_objects = ()
+
+    def get_url(self):
+        opts = self.field.remote_field.model._meta
+        return reverse(f'{self.admin_site.name}:{opts.app_label}_{opts.model_name}_autocomplete')
+
+    def optgroups(self, name, value, attr=None):
+        to_field_name = self.field.remote_field.get_related_field().attname
+        selected_choices = {str(x) for x in value if str(x) not in self.choices.field.empty_values}
+        known = [x for x in self.known_objects if str(getattr(x, to_field_name)) in selected_choices]
+        if not selected_choices or len(known) < len(selected_choices):
+            return super().optgroups(name, value, attr)
+        options = [] if self.is_required else [self.create_option(name, '', '', False, 0)]
+        for obj in known:
+            options.append(self.create_option(
+                name, getattr(obj, to_field_name), self.choices.field.label_from_instance(obj), True, len(options),
+            ))
+        return [(None, options, 0)]
+
+
+class PrefixAutocompleteMixin:
+    """ModelAdmin с собственным адресом автодополнения по полю autocomplete_field"""
+    autocomplete_field = None
+
+    def get_urls(self):
+        opts = self.model._meta
+        return [
+            path(
+                'autocomplete/',
+                self.admin_site.admin_view(PrefixAutocompleteJsonView.as_view(admin_site=self.admin_site)),
+                name=f'{opts.app_label}_{opts.model_name}_autocomplete',
+            ),
+            *super().get_urls(),
+        ]
+
+
+class PrefixAutocompleteInlineMixin:
+    """Inline, в котором поля из autocomplete_fields используют PrefixAutocompleteSelect"""
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name in self.get_autocomplete_fields(request):
+            kwargs.setdefault('widget', PrefixAutocompleteSelect(db_field, self.admin_site, using=kwargs.get('using')))
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
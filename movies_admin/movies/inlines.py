@@ -0,0 +1,70 @@
+from typing import Optional, Union
+
+from django.core.paginator import Paginator
+from django.forms.models import BaseInlineFormSet
+from django.http import QueryDict
+from django.utils.functional import cached_property
+
+from .autocomplete import PrefixAutocompleteSelect
+
+
+class PagedInlineFormSet(BaseInlineFormSet):
+    """Inline-формы только для одной страницы связанных строк
+
+    Номер страницы берётся из параметра <prefix>-page адреса формы изменения;
+    сохранение идёт на тот же адрес, поэтому изменяются строки той же страницы.
+    Связанные объекты из select_related передаются виджетам автодополнения,
+    чтобы подпись выбранного значения не требовала запроса на каждую строку.
+    """
+    per_page = 20
+    query = QueryDict()
+
+    @property
+    def page_param(self) -> str:
+        return f'{self.prefix}-page'
+
+    @cached_property
+    def page(self):
+        return Paginator(super().get_queryset(), self.per_page).get_page(self.query.get(self.page_param))
+
+    def get_queryset(self):
+        return self.page.object_list
+
+    def page_links(self) -> list[tuple[Union[int, str], Optional[str]]]:
+        """Номера страниц вокруг текущей и адреса с остальными параметрами текущего адреса
+
+        Число ссылок не зависит от числа страниц: дальние заменяются многоточием без адреса.
+        """
+        links = []
+        for number in self.page.paginator.get_elided_page_range(self.page.number):
+            if number == Paginator.ELLIPSIS:
+                links.append((number, None))
+                continue
+            query = self.query.copy()
+            query[self.page_param] = number
+            links.append((number, f'?{query.urlencode()}'))
+        return links
+
+    def _construct_form(self, i, **kwargs):
+        form = super()._construct_form(i, **kwargs)
+        for name, field in form.fields.items():
+            widget = getattr(field.widget, 'widget', field.widget)
+            descriptor = getattr(self.model, name, None)
+            if isinstance(widget, PrefixAutocompleteSelect) and descriptor.field.is_cached(form.instance):
+                widget.known_objects = [getattr(form.instance, name)]
+        return form
+
+
+class PagedInlineMixin:
+    """InlineModelAdmin с постраничным PagedInlineFormSet и связанными объектами из select_related"""
+    formset = PagedInlineFormSet
+    template = 'admin/movies/edit_inline/paged_tabular.html'
+    select_related = ()
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related(*self.select_related)
+
+    def get_formset(self, request, obj=None, **kwargs):
+        formset = super().get_formset(request, obj, **kwargs)
+        formset.query = request.GET
+        return formset
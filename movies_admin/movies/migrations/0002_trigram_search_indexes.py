@@ -0,0 +1,54 @@
+import django.contrib.postgres.indexes
+import django.db.models.functions.comparison
+import django.db.models.functions.text
+from django.contrib.postgres.operations import AddIndexConcurrently, TrigramExtension
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Индексы строятся CONCURRENTLY, без блокировки записи в таблицы, это нельзя делать в транзакции
+    atomic = False
+
+    dependencies = [
+        ("movies", "0001_initial"),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        AddIndexConcurrently(
+            model_name="filmwork",
+            index=django.contrib.postgres.indexes.GinIndex(
+                django.contrib.postgres.indexes.OpClass(
+                    django.db.models.functions.text.Upper(
+                        django.db.models.functions.comparison.Cast("title", models.TextField())
+                    ),
+                    name="gin_trgm_ops",
+                ),
+                name="film_work_title_trgm_idx",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="filmwork",
+            index=django.contrib.postgres.indexes.GinIndex(
+                django.contrib.postgres.indexes.OpClass(
+                    django.db.models.functions.text.Upper(
+                        django.db.models.functions.comparison.Cast("description", models.TextField())
+                    ),
+                    name="gin_trgm_ops",
+                ),
+                name="film_work_description_trgm_idx",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="person",
+            index=django.contrib.postgres.indexes.GinIndex(
+                django.contrib.postgres.indexes.OpClass(
+                    django.db.models.functions.text.Upper(
+                        django.db.models.functions.comparison.Cast("full_name", models.TextField())
+                    ),
+                    name="gin_trgm_ops",
+                ),
+                name="person_full_name_trgm_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,27 @@
+import django.db.models.functions.comparison
+import django.db.models.functions.text
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ("movies", "0002_trigram_search_indexes"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="person",
+            index=models.Index(
+                django.db.models.functions.comparison.Collate(
+                    django.db.models.functions.text.Upper(
+                        django.db.models.functions.comparison.Cast("full_name", models.TextField())
+                    ),
+                    "C",
+                ),
+                name="person_full_name_prefix_idx",
+            ),
+        ),
+    ]
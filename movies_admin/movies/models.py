@@ -1,11 +1,23 @@
 import uuid
+from django.contrib.postgres.indexes import GinIndex, OpClass
 from django.db import models
+from django.db.models.functions import Cast, Collate, Upper
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.utils.translation import gettext_lazy as _
 
 # Create your models here.
 
 
+def trigram_index(field_name: str, name: str) -> GinIndex:
+    """Триграммный индекс под icontains: Django сравнивает UPPER(поле::text) LIKE UPPER(%s)"""
+    return GinIndex(OpClass(Upper(Cast(field_name, models.TextField())), name='gin_trgm_ops'), name=name)
+
+
+def prefix_key(field_name: str) -> Collate:
+    """Ключ поиска по началу строки: в побайтовом порядке "C" LIKE 'ABC%' и ORDER BY идут по одному индексу"""
+    return Collate(Upper(Cast(field_name, models.TextField())), 'C')
+
+
 class TimeStampedMixin(models.Model):
     created = models.DateTimeField(auto_now_add=True)
     modified = models.DateTimeField(auto_now=True)
@@ -44,6 +56,10 @@ class Person(UUIDMixin, TimeStampedMixin):
 
     class Meta:
         db_table = "content\".\"person"
+        indexes = [
+            trigram_index('full_name', 'person_full_name_trgm_idx'),
+            models.Index(prefix_key('full_name'), name='person_full_name_prefix_idx'),
+        ]
         verbose_name = _('Persona')
         verbose_name_plural = _('Personas')
 
@@ -74,6 +90,10 @@ class FilmWork(UUIDMixin, TimeStampedMixin):
 
     class Meta:
         db_table = "content\".\"film_work"
+        indexes = [
+            trigram_index('title', 'film_work_title_trgm_idx'),
+            trigram_index('description', 'film_work_description_trgm_idx'),
+        ]
         verbose_name = _('Filmwork')
         verbose_name_plural = _('Filmworks')
 
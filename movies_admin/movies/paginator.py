@@ -0,0 +1,66 @@
+import json
+
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+# До этого числа строк итог считается точно ограниченным COUNT(*), дальше - оценивается
+ESTIMATE_THRESHOLD = 10_000
+
+
+class EstimatedCountPaginator(Paginator):
+    """Пагинатор с оценкой числа строк вместо COUNT(*) по большим таблицам
+
+    Сначала строки считаются точно, но не дальше ESTIMATE_THRESHOLD + 1: маленькие
+    и узко отфильтрованные списки получают точный итог. Только если этот предел
+    достигнут, итог оценивается: для списка без отбора по pg_class.reltuples,
+    для отфильтрованного или по ещё не анализированной таблице - по оценке
+    планировщика из EXPLAIN. Оценка не бывает меньше уже подсчитанных строк.
+    is_estimated показывает, что итог приблизительный.
+    """
+    is_estimated = False
+
+    def _table_estimate(self) -> int:
+        queryset = self.object_list
+        with connections[queryset.db].cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                [connections[queryset.db].ops.quote_name(queryset.model._meta.db_table)],
+            )
+            return cursor.fetchone()[0]
+
+    def _plan_estimate(self) -> int:
+        queryset = self.object_list
+        sql, params = queryset.query.sql_with_params()
+        with connections[queryset.db].cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return plan[0]['Plan']['Plan Rows']
+
+    @cached_property
+    def count(self) -> int:
+        queryset = self.object_list
+        if not hasattr(queryset, 'query'):
+            return super().count
+        # SELECT count(*) FROM (... LIMIT ESTIMATE_THRESHOLD + 1)
+        capped = queryset.order_by()[:ESTIMATE_THRESHOLD + 1].count()
+        if capped <= ESTIMATE_THRESHOLD:
+            return capped
+        if queryset.query.has_filters():
+            estimate = self._plan_estimate()
+        else:
+            estimate = self._table_estimate()
+            if estimate < 0:
+                # reltuples = -1, пока таблицу не анализировали: оценку даёт планировщик
+                estimate = self._plan_estimate()
+        self.is_estimated = True
+        return max(estimate, capped)
+
+
+class EstimatedCountMixin:
+    """Настройки ModelAdmin для больших таблиц: приблизительный итог без второго COUNT(*)"""
+    paginator = EstimatedCountPaginator
+    # Иначе админка отдельно считает полный итог без отбора
+    show_full_result_count = False
@@ -0,0 +1,213 @@
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .models import FilmWork, Genre, GenreFilmWork, Person, PersonFilmWork
+from .paginator import EstimatedCountPaginator
+
+FILMS_COUNT = 5
+
+
+class FilmWorkChangelistTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+        genres = [Genre.objects.create(name=f'Genre {x}') for x in range(3)]
+        cls.films = [
+            FilmWork.objects.create(title=f'Film {x}', creation_date='2020-01-01', rating=5.0)
+            for x in range(FILMS_COUNT)
+        ]
+        for film in cls.films:
+            for genre in genres:
+                GenreFilmWork.objects.create(film_work=film, genre=genre)
+
+    def add_cast(self, size: int):
+        persons = Person.objects.bulk_create([Person(full_name=f'Person {x}') for x in range(size)])
+        PersonFilmWork.objects.bulk_create([
+            PersonFilmWork(film_work=film, person=person, role=PersonFilmWork.Roles.ACTOR)
+            for film in self.films for person in persons
+        ])
+
+    def get_changelist(self) -> CaptureQueriesContext:
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('admin:movies_filmwork_changelist'))
+        self.assertEqual(response.status_code, 200)
+        return queries
+
+    # Число запросов страницы списка не зависит от числа фильмов на странице и размера их состава
+    def test_changelist_query_count_does_not_grow_with_cast(self):
+        self.client.force_login(self.user)
+        self.add_cast(2)
+        small_cast = self.get_changelist()
+        self.add_cast(50)
+        large_cast = self.get_changelist()
+        self.assertEqual(len(small_cast), len(large_cast))
+        self.assertLessEqual(len(large_cast), 8)
+
+    # Строки жанров и состава собираются только для списка, а не для формы фильма
+    def test_change_form_does_not_aggregate_cast(self):
+        self.client.force_login(self.user)
+        self.add_cast(50)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('admin:movies_filmwork_change', args=[self.films[0].pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([x['sql'] for x in queries if 'STRING_AGG' in x['sql'].upper()])
+
+    # Жанры и участники с локализованными ролями приходят готовыми строками из базы
+    def test_changelist_renders_aggregated_genres_and_roles(self):
+        self.client.force_login(self.user)
+        self.add_cast(1)
+        response = self.client.get(reverse('admin:movies_filmwork_changelist'))
+        self.assertContains(response, 'Genre 0, Genre 1, Genre 2')
+        self.assertContains(response, f'Person 0 ({PersonFilmWork.Roles.ACTOR.label})')
+
+
+class EstimatedCountPaginatorTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Person.objects.bulk_create([Person(full_name=f'Person {x}') for x in range(30)])
+
+    # Маленький список считается точно
+    def test_small_table_is_counted_exactly(self):
+        paginator = EstimatedCountPaginator(Person.objects.order_by('full_name'), 10)
+        self.assertEqual(paginator.count, 30)
+        self.assertFalse(paginator.is_estimated)
+
+    # Отбор с немногими совпадениями считается точно, какой бы ни была оценка планировщика
+    def test_small_filtered_result_is_counted_exactly(self):
+        queryset = Person.objects.filter(full_name__in=['Person 1', 'Person 2', 'Person 3']).order_by('full_name')
+        with mock.patch('movies.paginator.ESTIMATE_THRESHOLD', 5), \
+                mock.patch.object(EstimatedCountPaginator, '_plan_estimate', return_value=12_000):
+            paginator = EstimatedCountPaginator(queryset, 10)
+            self.assertEqual(paginator.count, 3)
+        self.assertFalse(paginator.is_estimated)
+
+    # Выше порога отфильтрованный список берёт оценку планировщика
+    def test_filtered_queryset_uses_plan_estimate(self):
+        queryset = Person.objects.filter(full_name__startswith='Person').order_by('full_name')
+        with mock.patch('movies.paginator.ESTIMATE_THRESHOLD', 1):
+            paginator = EstimatedCountPaginator(queryset, 10)
+            self.assertGreater(paginator.count, 0)
+        self.assertTrue(paginator.is_estimated)
+
+    # Пока таблицу не анализировали, reltuples = -1 и итог оценивает планировщик
+    def test_unanalyzed_table_uses_plan_estimate(self):
+        with mock.patch('movies.paginator.ESTIMATE_THRESHOLD', 1), \
+                mock.patch.object(EstimatedCountPaginator, '_table_estimate', return_value=-1), \
+                mock.patch.object(EstimatedCountPaginator, '_plan_estimate', return_value=12_000):
+            paginator = EstimatedCountPaginator(Person.objects.order_by('full_name'), 10)
+            self.assertEqual(paginator.count, 12_000)
+        self.assertTrue(paginator.is_estimated)
+
+    # В подписи списка приблизительный итог помечен знаком ≈
+    def test_changelist_marks_estimated_count(self):
+        self.client.force_login(get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password'))
+        with mock.patch('movies.paginator.ESTIMATE_THRESHOLD', 1):
+            response = self.client.get(reverse('admin:movies_person_changelist'), {'q': 'Person'})
+        self.assertContains(response, '≈')
+
+
+class IndexedSearchTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+        cls.film = FilmWork.objects.create(title='Star Trek', creation_date='2020-01-01', rating=5.0)
+        FilmWork.objects.create(title='Star Wars', creation_date='2020-01-01', rating=5.0)
+
+    def search(self, term: str):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('admin:movies_filmwork_changelist'), {'q': term})
+        self.assertEqual(response.status_code, 200)
+        return list(response.context['cl'].result_list)
+
+    # uuid ищется точным совпадением по первичному ключу
+    def test_uuid_term_matches_primary_key(self):
+        self.assertEqual(self.search(f' {self.film.pk} '), [self.film])
+
+    # Остальные строки ищутся по вхождению в название без учёта регистра
+    def test_text_term_matches_title_substring(self):
+        self.assertEqual({x.title for x in self.search('sTAR')}, {'Star Trek', 'Star Wars'})
+        self.assertEqual(self.search('trek'), [self.film])
+
+
+class PrefixAutocompleteTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+        Person.objects.bulk_create([Person(full_name=f'Anna {x:02}') for x in range(25)] + [Person(full_name='Boris')])
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def autocomplete(self, term: str, page: int = 1) -> dict:
+        response = self.client.get(reverse('admin:movies_person_autocomplete'), {
+            'term': term, 'page': page, 'app_label': 'movies', 'model_name': 'personfilmwork', 'field_name': 'person',
+        })
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    # Поиск идёт по началу имени без учёта регистра, следующая страница определяется без подсчёта
+    def test_prefix_pages(self):
+        first = self.autocomplete('anna')
+        self.assertEqual([x['text'] for x in first['results']], [f'Anna {x:02}' for x in range(20)])
+        self.assertTrue(first['pagination']['more'])
+        second = self.autocomplete('anna', page=2)
+        self.assertEqual(len(second['results']), 5)
+        self.assertFalse(second['pagination']['more'])
+
+    # Повторный ввод отдаётся из кэша без запроса к таблице персон
+    def test_repeated_term_is_cached(self):
+        self.autocomplete('bor')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual([x['text'] for x in self.autocomplete('bor')['results']], ['Boris'])
+        self.assertFalse([x for x in queries if 'content"."person' in x['sql']])
+
+    # Виджет в составе фильма обращается к собственному адресу автодополнения
+    def test_inline_widget_uses_prefix_view(self):
+        response = self.client.get(reverse('admin:movies_filmwork_add'))
+        self.assertContains(response, reverse('admin:movies_person_autocomplete'))
+        self.assertContains(response, reverse('admin:movies_genre_autocomplete'))
+
+
+class PagedCastInlineTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+        cls.film = FilmWork.objects.create(title='Film', creation_date='2020-01-01', rating=5.0)
+
+    def add_cast(self, size: int):
+        persons = Person.objects.bulk_create([Person(full_name=f'Person {x:03}') for x in range(size)])
+        PersonFilmWork.objects.bulk_create([
+            PersonFilmWork(film_work=self.film, person=x, role=PersonFilmWork.Roles.ACTOR) for x in persons
+        ])
+
+    def get_change_form(self, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('admin:movies_filmwork_change', args=[self.film.pk]), params)
+        self.assertEqual(response.status_code, 200)
+        return response, queries
+
+    # Число запросов формы фильма не зависит от размера состава
+    def test_change_form_query_count_does_not_grow_with_cast(self):
+        self.client.force_login(self.user)
+        self.add_cast(3)
+        _, small_cast = self.get_change_form()
+        self.add_cast(200)
+        response, large_cast = self.get_change_form()
+        self.assertEqual(len(small_cast), len(large_cast))
+        self.assertEqual(response.context['inline_admin_formsets'][1].formset.initial_form_count(), 20)
+
+    # Вторая страница состава открывается по параметру адреса
+    def test_cast_page_param(self):
+        self.client.force_login(self.user)
+        self.add_cast(25)
+        response, _ = self.get_change_form(**{'personfilmwork_set-page': 2})
+        formset = response.context['inline_admin_formsets'][1].formset
+        self.assertEqual([x.instance.person.full_name for x in formset.initial_forms], [f'Person {x:03}' for x in range(20, 25)])
+        self.assertContains(response, '?personfilmwork_set-page=1')
@@ -0,0 +1,206 @@
+import argparse
+import datetime
+import hashlib
+import logging
+import random
+import sys
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import psycopg
+from dotenv import load_dotenv
+from faker import Faker
+
+# Сущностей (фильмов или персон) в одной задаче генерации
+CHUNK_SIZE = 20_000
+SEED = 42
+
+# Среднее число персон на фильм, по нему из числа связей считается число фильмов
+MEAN_PERSONS_PER_FILM = 10
+MAX_PERSONS_PER_FILM = 100
+PERSONS_PER_LINK = 20
+# Перекос популярности персон: индекс персоны = persons * random() ** PERSON_SKEW,
+# при 3 примерно пятая часть связей приходится на 1% самых популярных персон
+PERSON_SKEW = 3
+MAX_GENRES_PER_FILM = 3
+
+GENRES = (
+    'Drama', 'Comedy', 'Action', 'Thriller', 'Romance', 'Crime', 'Adventure', 'Horror', 'Documentary',
+    'Animation', 'Family', 'Fantasy', 'Mystery', 'Sci-Fi', 'Biography', 'History', 'Music', 'War',
+    'Sport', 'Western', 'Musical', 'Short', 'Reality-TV', 'Talk-Show', 'Game-Show', 'News',
+)
+# Популярность жанров убывает по закону Ципфа в порядке списка
+GENRE_WEIGHTS = tuple(1 / (x + 1) for x in range(len(GENRES)))
+
+ROLES = {
+    'actor': 70,
+    'writer': 7,
+    'producer': 7,
+    'director': 6,
+    'composer': 3,
+    'casting director': 2,
+    'production designer': 2,
+    'costume designer': 1.5,
+    'makeup artist': 1.5,
+}
+FILM_TYPES = {'movie': 80, 'tv_show': 20}
+
+START = datetime.datetime(2015, 1, 1, tzinfo=datetime.UTC)
+PERIOD_SECONDS = 10 * 365 * 24 * 3600
+
+COLUMNS = {
+    'film_work': (('id', 'uuid'), ('title', 'text'), ('description', 'text'), ('creation_date', 'date'),
+                  ('rating', 'float8'), ('type', 'text'), ('created', 'timestamptz'), ('modified', 'timestamptz')),
+    'person': (('id', 'uuid'), ('full_name', 'text'), ('created', 'timestamptz'), ('modified', 'timestamptz')),
+    'genre': (('id', 'uuid'), ('name', 'text'), ('description', 'text'), ('created', 'timestamptz'),
+              ('modified', 'timestamptz')),
+    'genre_film_work': (('id', 'uuid'), ('film_work_id', 'uuid'), ('genre_id', 'uuid'), ('created', 'timestamptz')),
+    'person_film_work': (('id', 'uuid'), ('film_work_id', 'uuid'), ('person_id', 'uuid'), ('role', 'text'),
+                         ('created', 'timestamptz')),
+}
+
+
+def entity_id(seed: int, kind: str, index: int) -> uuid.UUID:
+    """id сущности по её номеру: связи ссылаются на фильмы и персон без общих списков между процессами"""
+    digest = hashlib.blake2b(f'{seed}:{kind}:{index}'.encode(), digest_size=16).digest()
+    return uuid.UUID(bytes=digest, version=4)
+
+
+def random_id(rnd: random.Random) -> uuid.UUID:
+    return uuid.UUID(int=rnd.getrandbits(128), version=4)
+
+
+def timestamps(rnd: random.Random) -> tuple[datetime.datetime, datetime.datetime]:
+    created = START + datetime.timedelta(seconds=rnd.randrange(PERIOD_SECONDS))
+    return created, created + datetime.timedelta(seconds=rnd.randrange(PERIOD_SECONDS // 10))
+
+
+def films_rows(seed: int, chunk: int, films: int):
+    rnd = random.Random(f'{seed}:film_work:{chunk}')
+    fake = Faker()
+    fake.seed_instance(f'{seed}:film_work:{chunk}')
+    for index in range(chunk * CHUNK_SIZE, min((chunk + 1) * CHUNK_SIZE, films)):
+        created, modified = timestamps(rnd)
+        yield (
+            entity_id(seed, 'film_work', index), fake.catch_phrase().title(), fake.paragraph(nb_sentences=4),
+            fake.date_between(datetime.date(1920, 1, 1), datetime.date(2025, 1, 1)),
+            round(min(max(rnd.gauss(6.5, 1.5), 0), 10), 1), rnd.choices(tuple(FILM_TYPES), tuple(FILM_TYPES.values()))[0],
+            created, modified,
+        )
+
+
+def persons_rows(seed: int, chunk: int, persons: int):
+    rnd = random.Random(f'{seed}:person:{chunk}')
+    fake = Faker()
+    fake.seed_instance(f'{seed}:person:{chunk}')
+    for index in range(chunk * CHUNK_SIZE, min((chunk + 1) * CHUNK_SIZE, persons)):
+        yield (entity_id(seed, 'person', index), fake.name(), *timestamps(rnd))
+
+
+def genres_rows(seed: int):
+    rnd = random.Random(f'{seed}:genre')
+    for index, name in enumerate(GENRES):
+        yield (entity_id(seed, 'genre', index), name, None, *timestamps(rnd))
+
+
+def genre_links_rows(seed: int, chunk: int, films: int):
+    rnd = random.Random(f'{seed}:genre_film_work:{chunk}')
+    genre_indexes = range(len(GENRES))
+    for index in range(chunk * CHUNK_SIZE, min((chunk + 1) * CHUNK_SIZE, films)):
+        film_id = entity_id(seed, 'film_work', index)
+        genres = set(rnd.choices(genre_indexes, GENRE_WEIGHTS, k=rnd.randint(1, MAX_GENRES_PER_FILM)))
+        for genre_index in sorted(genres):
+            yield (random_id(rnd), film_id, entity_id(seed, 'genre', genre_index), timestamps(rnd)[0])
+
+
+def person_links_rows(seed: int, chunk: int, films: int, persons: int):
+    rnd = random.Random(f'{seed}:person_film_work:{chunk}')
+    roles, weights = tuple(ROLES), tuple(ROLES.values())
+    for index in range(chunk * CHUNK_SIZE, min((chunk + 1) * CHUNK_SIZE, films)):
+        film_id = entity_id(seed, 'film_work', index)
+        # Состав фильма: чаще несколько человек, изредка большой
+        count = min(MAX_PERSONS_PER_FILM, 1 + int(rnd.expovariate(1 / (MEAN_PERSONS_PER_FILM - 1))))
+        # Пара персона-роль уникальна в фильме, как требует persons_film_work_person_idx
+        pairs = {
+            (int(persons * rnd.random() ** PERSON_SKEW), rnd.choices(roles, weights)[0])
+            for _ in range(count)
+        }
+        for person_index, role in sorted(pairs):
+            yield (random_id(rnd), film_id, entity_id(seed, 'person', person_index), role, timestamps(rnd)[0])
+
+
+def copy_rows(dsn: dict, table_name: str, rows) -> int:
+    """Бинарный COPY строк задачи на собственном соединении процесса"""
+    columns = COLUMNS[table_name]
+    count = 0
+    with psycopg.connect(**dsn) as conn, conn.cursor() as cur:
+        column_list = ', '.join(x[0] for x in columns)
+        with cur.copy(f'COPY content.{table_name} ({column_list}) FROM STDIN (FORMAT BINARY)') as copy:
+            copy.set_types([x[1] for x in columns])
+            for row in rows:
+                copy.write_row(row)
+                count += 1
+    return count
+
+
+def generate_chunk(dsn: dict, table_name: str, seed: int, chunk: int, films: int, persons: int) -> tuple[str, int]:
+    generators = {
+        'film_work': lambda: films_rows(seed, chunk, films),
+        'person': lambda: persons_rows(seed, chunk, persons),
+        'genre': lambda: genres_rows(seed),
+        'genre_film_work': lambda: genre_links_rows(seed, chunk, films),
+        'person_film_work': lambda: person_links_rows(seed, chunk, films, persons),
+    }
+    return table_name, copy_rows(dsn, table_name, generators[table_name]())
+
+
+def generate(dsn: dict, links: int, persons: int, seed: int = SEED, workers: int = None):
+    """Заполнение всех таблиц content: сначала фильмы, персоны и жанры, затем связи
+
+    Каждая задача получает свой генератор случайных чисел от seed, таблицы и номера
+    задачи, поэтому при одинаковых параметрах данные совпадают независимо от числа процессов.
+    """
+    films = max(links // MEAN_PERSONS_PER_FILM, 1)
+    film_chunks = range((films + CHUNK_SIZE - 1) // CHUNK_SIZE)
+    person_chunks = range((persons + CHUNK_SIZE - 1) // CHUNK_SIZE)
+    phases = (
+        [('genre', 0)] + [('film_work', x) for x in film_chunks] + [('person', x) for x in person_chunks],
+        [('genre_film_work', x) for x in film_chunks] + [('person_film_work', x) for x in film_chunks],
+    )
+    logging.info('Фильмов %s, персон %s, жанров %s, связей с персонами около %s', films, persons, len(GENRES), links)
+    with ProcessPoolExecutor(workers) as pool:
+        # Связи пишутся только после родителей, иначе сработают внешние ключи
+        for tasks in phases:
+            totals = {}
+            futures = [pool.submit(generate_chunk, dsn, x, seed, y, films, persons) for x, y in tasks]
+            for future in futures:
+                table_name, count = future.result()
+                totals[table_name] = totals.get(table_name, 0) + count
+            for table_name, count in totals.items():
+                logging.info('Таблица %s: записано %s строк', table_name, count)
+
+
+if __name__ == '__main__':
+    # Параметры подключения читаются так же, как в переносе из SQLite
+    sys.path.append(str(Path(__file__).resolve().parent.parent / 'sqlite_to_postgres'))
+    from data_loader import dsl_from_env
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+    parser = argparse.ArgumentParser(description='Генерация синтетических данных для схемы content')
+    parser.add_argument('--links', type=int, default=1_000_000, help='примерное число строк person_film_work')
+    parser.add_argument('--persons', type=int, help='число персон, по умолчанию одна на 20 связей')
+    parser.add_argument('--seed', type=int, default=SEED, help='зерно генератора, одинаковое зерно даёт одинаковые данные')
+    parser.add_argument('--workers', type=int, help='число процессов, по умолчанию по числу ядер')
+    parser.add_argument('--truncate', action='store_true', help='очистить таблицы content перед генерацией')
+    args = parser.parse_args()
+
+    dsn = dsl_from_env()
+    if args.truncate:
+        with psycopg.connect(**dsn) as conn:
+            conn.execute('TRUNCATE content.film_work, content.person, content.genre CASCADE')
+    started = time.perf_counter()
+    generate(dsn, args.links, args.persons or max(args.links // PERSONS_PER_LINK, MAX_PERSONS_PER_FILM), args.seed, args.workers)
+    logging.info('Генерация заняла %.1f с', time.perf_counter() - started)
@@ -0,0 +1,131 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from contextlib import closing
+from typing import Optional, Union
+from uuid import UUID
+
+import psycopg
+from psycopg import AsyncClientCursor
+
+from batch_sizer import BatchSizer, batch_bytes
+from data_loader import BATCH_SIZE, LoadOptions
+from db_data_classes import FilmWork, Person, Genre, GenreFilmWork, PersonFilmWork
+from pgsql_context_manager import AsyncPostgresSaver
+from sqlite_context_manger import AsyncSQLiteLoader, connect_sqlite
+
+# На сколько диапазонов id делится таблица
+PARTITIONS = 16
+# Сколько соединений с Postgres делят между собой диапазоны
+CONNECTIONS = 4
+# Сколько строк диапазона пишется в одной транзакции
+COMMIT_ROWS = 50_000
+# Как часто выводится прогресс по диапазонам, в секундах
+PROGRESS_INTERVAL = 10
+
+
+def partition_bounds(partitions: int) -> list[tuple[Optional[str], Optional[str]]]:
+    """Равные диапазоны пространства UUID, крайние диапазоны открыты"""
+    step = (1 << 128) // partitions
+    bounds = [str(UUID(int=step * x)) for x in range(1, partitions)]
+    return list(zip([None, *bounds], [*bounds, None]))
+
+
+async def _report_progress(table_name: str, progress: list[int], interval: int):
+    while True:
+        await asyncio.sleep(interval)
+        logging.info(
+            'Таблица %s: %s строк, по диапазонам %s',
+            table_name, sum(progress), ', '.join(str(x) for x in progress),
+        )
+
+
+async def _load_partition(sqlite_path: str, pool: asyncio.Queue, table_name: str, table_class: Union[FilmWork, Person, Genre, GenreFilmWork, PersonFilmWork], number: int, bounds: tuple[Optional[str], Optional[str]], progress: list[int], options: LoadOptions, executor: Executor):
+    """Перенос одного диапазона id: своё соединение SQLite, соединение Postgres берётся из пула на одну фиксацию
+
+    Размер пачки подбирается для диапазона отдельно, если таблица не закреплена в --batch-sizes.
+    Пачки пишутся в одно соединение, пока не наберётся COMMIT_ROWS строк или не кончится диапазон.
+    """
+    low, high = bounds
+    conditions, params = [], []
+    if low is not None:
+        conditions.append('id >= ?')
+        params.append(low)
+    if high is not None:
+        conditions.append('id < ?')
+        params.append(high)
+    pinned_size = options.batch_sizes.get(table_name)
+    batch_sizer = BatchSizer(table_name, pinned_size or BATCH_SIZE, options.memory_limit, adaptive=pinned_size is None)
+    pg_conn, uncommitted = None, 0
+    try:
+        with closing(connect_sqlite(sqlite_path)) as sqlite_conn:
+            sqlite_loader = AsyncSQLiteLoader(sqlite_conn, BATCH_SIZE, executor, options.metrics)
+            batches = sqlite_loader.transform_data(table_name, table_class, where=' AND '.join(conditions), params=tuple(params), batch_sizer=batch_sizer)
+            started = time.perf_counter()
+            async for batch in batches:
+                load_started = time.perf_counter()
+                if pg_conn is None:
+                    pg_conn = await pool.get()
+                    # Ожидание свободного соединения не относится к скорости пачки
+                    waited = time.perf_counter() - load_started
+                    started += waited
+                    load_started += waited
+                await AsyncPostgresSaver(pg_conn, options.writer, upsert=options.incremental).save_data(batch, table_name, table_class)
+                uncommitted += len(batch)
+                if uncommitted >= COMMIT_ROWS:
+                    await pg_conn.commit()
+                    pool.put_nowait(pg_conn)
+                    pg_conn, uncommitted = None, 0
+                finished = time.perf_counter()
+                nbytes = batch_bytes(batch)
+                batch_sizer.record(len(batch), nbytes, finished - started)
+                if options.metrics:
+                    options.metrics.observe(table_name, 'load', finished - load_started)
+                    options.metrics.record_batch(table_name, len(batch), nbytes)
+                progress[number] += len(batch)
+                started = finished
+        if pg_conn is not None:
+            await pg_conn.commit()
+    except BaseException:
+        if pg_conn is not None:
+            await pg_conn.rollback()
+        raise
+    finally:
+        if pg_conn is not None:
+            pool.put_nowait(pg_conn)
+    logging.info('Таблица %s: диапазон %s загружен, %s строк, размер пачки %s', table_name, number, progress[number], batch_sizer.size)
+
+
+async def load_table_partitioned(sqlite_path: str, dsl: dict, table_name: str, table_class: Union[FilmWork, Person, Genre, GenreFilmWork, PersonFilmWork], options: Optional[LoadOptions] = None, partitions: int = PARTITIONS, connections: int = CONNECTIONS, executor: Optional[Executor] = None):
+    """Перенос одной таблицы параллельно по диапазонам id
+
+    Каждый диапазон читается из своего соединения SQLite, запись идёт через общий
+    пул асинхронных соединений Postgres, фиксация - каждые COMMIT_ROWS строк диапазона.
+    """
+    options = options or LoadOptions()
+    logging.info('Перенос данных таблицы %s по %s диапазонам', table_name, partitions)
+    pool = asyncio.Queue()
+    pg_conns = []
+    progress = [0] * partitions
+    reporter = asyncio.create_task(_report_progress(table_name, progress, PROGRESS_INTERVAL))
+    try:
+        for _ in range(connections):
+            pg_conn = await psycopg.AsyncConnection.connect(**dsl, cursor_factory=AsyncClientCursor)
+            pg_conns.append(pg_conn)
+            pool.put_nowait(pg_conn)
+        async with asyncio.TaskGroup() as tasks:
+            for number, bounds in enumerate(partition_bounds(partitions)):
+                tasks.create_task(_load_partition(sqlite_path, pool, table_name, table_class, number, bounds, progress, options, executor))
+    finally:
+        reporter.cancel()
+        for pg_conn in pg_conns:
+            await pg_conn.close()
+    logging.info('Таблица %s загружена, %s строк', table_name, sum(progress))
+
+
+async def load_from_sqlite_async(sqlite_path: str, dsl: dict, tables_for_load: dict[str, Union[FilmWork, Person, Genre, GenreFilmWork, PersonFilmWork]], options: Optional[LoadOptions] = None, partitions: int = PARTITIONS, connections: int = CONNECTIONS):
+    """Разовый массовый перенос: таблицы по очереди с учётом зависимостей, каждая по диапазонам id"""
+    with ProcessPoolExecutor() as executor:
+        for table_name, table_class in tables_for_load.items():
+            await load_table_partitioned(sqlite_path, dsl, table_name, table_class, options, partitions, connections, executor)
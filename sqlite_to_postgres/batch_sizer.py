@@ -0,0 +1,92 @@
+import logging
+from typing import Optional
+
+MIN_BATCH_SIZE = 10
+MAX_BATCH_SIZE = 50000
+# Бюджет памяти на одну пачку таблицы по умолчанию
+MEMORY_LIMIT = 64 * 1024 * 1024
+# Во сколько раз растёт размер пачки за шаг
+GROW_FACTOR = 2
+# Рост скорости меньше этой доли считается шумом
+TOLERANCE = 0.05
+# Сколько полных пачек одного размера усредняется для оценки скорости
+PROBE_BATCHES = 3
+# Сколько строк пачки просматривается для оценки её объёма
+SAMPLE_ROWS = 20
+
+
+def batch_bytes(batch: list[tuple]) -> int:
+    """Оценка объёма пачки по выборке строк: длина строковых значений, остальные по 16 байт"""
+    if not batch:
+        return 0
+    step = max(1, len(batch) // SAMPLE_ROWS)
+    sample = batch[::step]
+    sample_bytes = sum(len(x) if isinstance(x, str) else 16 for row in sample for x in row)
+    return sample_bytes * len(batch) // len(sample)
+
+
+class BatchSizer:
+    """Подбор размера пачки по измеренной скорости в пределах бюджета памяти
+
+    Пачка удваивается, пока усреднённая скорость заметно растёт, после этого
+    возвращается лучший размер и больше не меняется. Размер всегда ограничен так,
+    чтобы пачка помещалась в memory_limit.
+    """
+
+    def __init__(self, table_name: str, size: int, memory_limit: int = MEMORY_LIMIT, adaptive: bool = True):
+        self.table_name = table_name
+        self.size = size
+        self._memory_limit = memory_limit
+        self._adaptive = adaptive
+        self._best_rate: Optional[float] = None
+        self._best_size = size
+        self._settled = False
+        self._probe_batches = 0
+        self._probe_rows = 0
+        self._probe_seconds = 0.0
+        self.rows = 0
+        self.bytes = 0
+        self.seconds = 0.0
+
+    @property
+    def bytes_per_row(self) -> float:
+        return self.bytes / self.rows if self.rows else 0.0
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def record(self, rows: int, nbytes: int, seconds: float):
+        self.rows += rows
+        self.bytes += nbytes
+        self.seconds += seconds
+        # Неполная пачка бывает только последней, по ней скорость не оценивается
+        if not self._adaptive or rows < self.size or seconds <= 0:
+            return
+        size = self.size
+        self._probe_batches += 1
+        self._probe_rows += rows
+        self._probe_seconds += seconds
+        if not self._settled and self._probe_batches >= PROBE_BATCHES:
+            rate = self._probe_rows / self._probe_seconds
+            self._probe_batches, self._probe_rows, self._probe_seconds = 0, 0, 0.0
+            if self._best_rate is None or rate > self._best_rate * (1 + TOLERANCE):
+                self._best_rate, self._best_size = rate, size
+                size = size * GROW_FACTOR
+            else:
+                size = self._best_size
+                self._settled = True
+        ceiling = MAX_BATCH_SIZE
+        if self.bytes_per_row:
+            ceiling = min(ceiling, int(self._memory_limit // self.bytes_per_row))
+        size = max(min(size, ceiling), MIN_BATCH_SIZE)
+        if size != self.size:
+            logging.debug('Таблица %s: размер пачки %s -> %s', self.table_name, self.size, size)
+            self.size = size
+            self._probe_batches, self._probe_rows, self._probe_seconds = 0, 0, 0.0
+
+    def log_summary(self):
+        logging.info(
+            'Таблица %s: размер пачки %s (--batch-sizes %s=%s), %.0f строк/с, %.0f байт/строку',
+            self.table_name, self.size, self.table_name, self.size, self.rows_per_second, self.bytes_per_row,
+        )
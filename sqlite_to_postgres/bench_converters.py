@@ -0,0 +1,34 @@
+import timeit
+import uuid
+from dataclasses import astuple
+from datetime import datetime, timezone
+
+from db_data_classes import PersonFilmWork
+from sqlite_context_manger import build_rows
+
+BATCH_SIZE = 100
+BATCHES = 1000
+
+
+def dataclass_path(batch: list[tuple]) -> list[tuple]:
+    """Прежний путь: датакласс с __post_init__ на строку и astuple перед записью"""
+    return [astuple(PersonFilmWork(*row_data)) for row_data in batch]
+
+
+def converter_path(batch: list[tuple]) -> list[tuple]:
+    return build_rows(PersonFilmWork, batch)
+
+
+if __name__ == '__main__':
+    created = datetime.now(timezone.utc).isoformat(sep=' ')
+    batch = [
+        (str(uuid.uuid4()), str(uuid.uuid4()), str(uuid.uuid4()), 'actor', created)
+        for _ in range(BATCH_SIZE)
+    ]
+    assert dataclass_path(batch) == converter_path(batch)
+    results = {}
+    for name, func in (('dataclass', dataclass_path), ('converter', converter_path)):
+        results[name] = min(timeit.repeat(lambda: func(batch), number=BATCHES, repeat=5))
+        rows_per_second = BATCH_SIZE * BATCHES / results[name]
+        print(f'{name:>10}: {results[name]:.3f} c, {rows_per_second:,.0f} строк/с')
+    print(f'Ускорение: {results["dataclass"] / results["converter"]:.1f}x')
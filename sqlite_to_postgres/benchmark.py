@@ -0,0 +1,221 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import random
+import resource
+import sqlite3
+import time
+from contextlib import closing
+from datetime import date, datetime, timedelta, timezone
+from uuid import UUID
+
+from dotenv import load_dotenv
+
+from data_loader import LoadOptions, connect_postgres, dsl_from_env, load_from_sqlite, tables_for_load
+from pgsql_context_manager import WRITER_COPY, WRITER_INSERT
+from sqlite_context_manger import connect_sqlite
+
+# Число строк person_film_work в синтетических источниках
+SCALES = (10_000, 1_000_000, 10_000_000)
+WRITERS = (WRITER_COPY, WRITER_INSERT)
+# Стратегии размера пачки: None - подбор на ходу, число - закреплённый размер
+BATCH_STRATEGIES = {
+    'adaptive': None,
+    'fixed-100': 100,
+    'fixed-5000': 5000,
+}
+SEED = 42
+# Сколько строк пишется в SQLite за один executemany
+WRITE_CHUNK = 50_000
+# Как часто ожидание результата прогона проверяет, жив ли процесс
+POLL_SECONDS = 5
+# Новый интерпретатор, а не fork: ru_maxrss не наследует пик памяти родителя после создания источников
+SPAWN = multiprocessing.get_context('spawn')
+
+SOURCE_SCHEMA = (
+    'CREATE TABLE film_work (id TEXT PRIMARY KEY, title TEXT NOT NULL, description TEXT, creation_date DATE, '
+    'file_path TEXT, rating FLOAT, type TEXT NOT NULL, created_at timestamp with time zone, '
+    'updated_at timestamp with time zone)',
+    'CREATE TABLE genre (id TEXT PRIMARY KEY, name TEXT NOT NULL, description TEXT, '
+    'created_at timestamp with time zone, updated_at timestamp with time zone)',
+    'CREATE TABLE person (id TEXT PRIMARY KEY, full_name TEXT NOT NULL, '
+    'created_at timestamp with time zone, updated_at timestamp with time zone)',
+    'CREATE TABLE genre_film_work (id TEXT PRIMARY KEY, film_work_id TEXT NOT NULL, genre_id TEXT NOT NULL, '
+    'created_at timestamp with time zone)',
+    'CREATE TABLE person_film_work (id TEXT PRIMARY KEY, film_work_id TEXT NOT NULL, person_id TEXT NOT NULL, '
+    'role TEXT NOT NULL, created_at timestamp with time zone)',
+)
+ROLES = ('actor', 'director', 'writer', 'producer')
+GENRES_COUNT = 30
+PERSONS_PER_FILM = 10
+GENRES_PER_FILM = 2
+
+
+def _uuid(rnd: random.Random) -> str:
+    return str(UUID(int=rnd.getrandbits(128), version=4))
+
+
+def _timestamp(rnd: random.Random) -> str:
+    moment = datetime(2020, 1, 1, tzinfo=timezone.utc) + timedelta(seconds=rnd.randrange(50_000_000), microseconds=rnd.randrange(1_000_000))
+    return moment.strftime('%Y-%m-%d %H:%M:%S.%f+00')
+
+
+def _write(sqlite_conn: sqlite3.Connection, table_name: str, rows):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= WRITE_CHUNK:
+            sqlite_conn.executemany(f'INSERT INTO {table_name} VALUES ({", ".join("?" * len(row))})', chunk)
+            chunk.clear()
+    if chunk:
+        sqlite_conn.executemany(f'INSERT INTO {table_name} VALUES ({", ".join("?" * len(chunk[0]))})', chunk)
+
+
+def create_source(path: str, link_rows: int, seed: int = SEED):
+    """Синтетический источник со схемой db.sqlite, person_film_work содержит link_rows строк"""
+    rnd = random.Random(seed)
+    films = max(link_rows // PERSONS_PER_FILM, 1)
+    persons = max(link_rows // 20, PERSONS_PER_FILM)
+    film_ids = [_uuid(rnd) for _ in range(films)]
+    person_ids = [_uuid(rnd) for _ in range(persons)]
+    genre_ids = [_uuid(rnd) for _ in range(GENRES_COUNT)]
+
+    with closing(sqlite3.connect(path)) as sqlite_conn:
+        sqlite_conn.execute('PRAGMA journal_mode = OFF')
+        sqlite_conn.execute('PRAGMA synchronous = OFF')
+        for ddl in SOURCE_SCHEMA:
+            sqlite_conn.execute(ddl)
+        _write(sqlite_conn, 'film_work', (
+            (film_id, f'Film {number}', f'Description of film {number} ' * rnd.randrange(1, 20),
+             (date(1950, 1, 1) + timedelta(days=rnd.randrange(27000))).isoformat(), None,
+             round(rnd.uniform(0, 10), 1), rnd.choice(('movie', 'tv_show')), _timestamp(rnd), _timestamp(rnd))
+            for number, film_id in enumerate(film_ids)
+        ))
+        _write(sqlite_conn, 'genre', (
+            (genre_id, f'Genre {number}', None, _timestamp(rnd), _timestamp(rnd))
+            for number, genre_id in enumerate(genre_ids)
+        ))
+        _write(sqlite_conn, 'person', (
+            (person_id, f'Person {number}', _timestamp(rnd), _timestamp(rnd))
+            for number, person_id in enumerate(person_ids)
+        ))
+        _write(sqlite_conn, 'genre_film_work', (
+            (_uuid(rnd), film_id, genre_id, _timestamp(rnd))
+            for film_id in film_ids for genre_id in rnd.sample(genre_ids, GENRES_PER_FILM)
+        ))
+        _write(sqlite_conn, 'person_film_work', (
+            (_uuid(rnd), film_id, person_id, rnd.choice(ROLES), _timestamp(rnd))
+            for film_id in film_ids for person_id in rnd.sample(person_ids, PERSONS_PER_FILM)
+        ))
+        sqlite_conn.commit()
+
+
+def _run_case(sqlite_path: str, dsl: dict, table_name: str, options: LoadOptions, results: multiprocessing.Queue):
+    """Перенос одной таблицы в отдельном процессе, чтобы пиковая память относилась только к ней"""
+    try:
+        results.put(_measure_table(sqlite_path, dsl, table_name, options))
+    except Exception as e:
+        results.put(e)
+        raise
+
+
+def _truncate(dsl: dict):
+    with closing(connect_postgres(dsl)) as pg_conn:
+        with pg_conn.cursor() as _cursor:
+            _cursor.execute(f'TRUNCATE {", ".join(f"content.{x}" for x in tables_for_load)} CASCADE')
+        pg_conn.commit()
+
+
+def _measure_table(sqlite_path: str, dsl: dict, table_name: str, options: LoadOptions) -> dict:
+    with closing(connect_sqlite(sqlite_path)) as sqlite_conn, closing(connect_postgres(dsl)) as pg_conn:
+        rows = sqlite_conn.execute(f'SELECT count(*) FROM {table_name}').fetchone()[0]
+        started = time.perf_counter()
+        load_from_sqlite(sqlite_conn, pg_conn, {table_name: tables_for_load[table_name]}, options)
+        pg_conn.commit()
+        seconds = time.perf_counter() - started
+    return {
+        'table': table_name,
+        'rows': rows,
+        'seconds': round(seconds, 3),
+        'rows_per_second': round(rows / seconds) if seconds else None,
+        # ru_maxrss в Linux в килобайтах, процесс переносит только эту таблицу
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def _wait_result(process: multiprocessing.Process, results: multiprocessing.Queue):
+    """Результат прогона; если процесс завершился без него (например, убит OOM killer), - исключение"""
+    while True:
+        try:
+            return results.get(timeout=POLL_SECONDS)
+        except queue.Empty:
+            if process.is_alive():
+                continue
+        # Процесс мог успеть положить результат перед самым завершением
+        try:
+            return results.get(timeout=POLL_SECONDS)
+        except queue.Empty:
+            raise RuntimeError(f'Прогон завершился без результата, код выхода {process.exitcode}') from None
+
+
+def run_benchmark(dsl: dict, scales: list[int], workdir: str) -> list[dict]:
+    report = []
+    for link_rows in scales:
+        sqlite_path = os.path.join(workdir, f'source_{link_rows}.sqlite')
+        if not os.path.exists(sqlite_path):
+            logging.info('Создание источника %s', sqlite_path)
+            create_source(sqlite_path, link_rows)
+        for writer in WRITERS:
+            for strategy, batch_size in BATCH_STRATEGIES.items():
+                options = LoadOptions(
+                    writer=writer,
+                    batch_sizes={x: batch_size for x in tables_for_load} if batch_size else {},
+                )
+                logging.info('Прогон: %s строк связей, запись %s, пачки %s', link_rows, writer, strategy)
+                started = time.perf_counter()
+                _truncate(dsl)
+                records = []
+                for table_name in tables_for_load:
+                    results = SPAWN.Queue()
+                    process = SPAWN.Process(target=_run_case, args=(sqlite_path, dsl, table_name, options, results))
+                    process.start()
+                    record = _wait_result(process, results)
+                    process.join()
+                    if isinstance(record, Exception):
+                        raise record
+                    records.append(record)
+                wall_time = time.perf_counter() - started
+                for record in records:
+                    report.append({'scale': link_rows, 'writer': writer, 'batch_strategy': strategy, **record})
+                report.append({
+                    'scale': link_rows, 'writer': writer, 'batch_strategy': strategy,
+                    'table': None, 'seconds': round(wall_time, 3),
+                })
+    return report
+
+
+if __name__ == '__main__':
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+    parser = argparse.ArgumentParser(description='Замер скорости переноса на синтетических источниках')
+    parser.add_argument('--scales', type=int, nargs='+', default=list(SCALES),
+                        help='число строк person_film_work в источниках')
+    parser.add_argument('--workdir', default='.', help='каталог для синтетических источников')
+    parser.add_argument('--output', default='benchmark_report.json', help='файл отчёта')
+    parser.add_argument('--dbname', default=os.getenv('BENCHMARK_DB_NAME'),
+                        help='отдельная база для замеров (BENCHMARK_DB_NAME), её таблицы content очищаются')
+    parser.add_argument('--yes-truncate', action='store_true',
+                        help='разрешить замеры в базе DB_NAME, которую использует перенос')
+    args = parser.parse_args()
+    if not args.dbname:
+        parser.error('укажите базу для замеров: --dbname или BENCHMARK_DB_NAME')
+    if args.dbname == os.getenv('DB_NAME') and not args.yes_truncate:
+        parser.error(f'база {args.dbname} используется переносом, замеры очистят её таблицы; добавьте --yes-truncate')
+    dsl = {**dsl_from_env(), 'dbname': args.dbname}
+    report = run_benchmark(dsl, args.scales, args.workdir)
+    with open(args.output, 'w') as report_file:
+        json.dump(report, report_file, ensure_ascii=False, indent=2)
+    logging.info('Отчёт записан в %s', args.output)
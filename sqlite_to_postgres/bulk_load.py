@@ -0,0 +1,199 @@
+from psycopg import connection as pg_connection
+from typing import Iterable, Iterator
+from contextlib import closing, contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict
+from data_loader import connect_postgres
+from pgsql_context_manager import pg_errors_logged
+import logging
+
+# Сколько индексов перестраивается и ограничений проверяется одновременно
+RESTORE_WORKERS = 4
+# Память на построение одного индекса, на каждое соединение восстановления
+MAINTENANCE_WORK_MEM = '256MB'
+
+INDEX = 'index'
+FOREIGN_KEY = 'foreign_key'
+
+
+class DeferredObjects:
+    """Вторичные индексы и внешние ключи, снятые на время массовой загрузки
+
+    Определение объекта записывается в etl.deferred_object в той же транзакции,
+    в которой объект удаляется, поэтому после падения процесса на любом шаге
+    ни одно определение не теряется и следующий запуск восстановит всё снятое.
+    Первичные ключи не снимаются: по ним работает ON CONFLICT (id). Уникальные
+    индексы тоже остаются: без них в таблицу попали бы повторы ключа, и индекс
+    потом не удалось бы построить заново.
+    """
+    _connection = None
+
+    def __init__(self, connection: pg_connection):
+        self._connection = connection
+
+    @staticmethod
+    def create_table(connection: pg_connection):
+        """Создание etl.deferred_object, вызывается до запуска параллельных соединений"""
+        with pg_errors_logged('etl.deferred_object'), closing(connection.cursor()) as _cursor:
+            _cursor.execute('CREATE SCHEMA IF NOT EXISTS etl')
+            _cursor.execute(
+                'CREATE TABLE IF NOT EXISTS etl.deferred_object ('
+                'name TEXT PRIMARY KEY, '
+                'kind TEXT NOT NULL, '
+                'table_name TEXT NOT NULL, '
+                'definition TEXT NOT NULL, '
+                'modified timestamp with time zone NOT NULL DEFAULT now())'
+            )
+        connection.commit()
+
+    def defer(self, table_names: Iterable[str]):
+        """Снятие внешних ключей и вторичных индексов таблиц content одной транзакцией"""
+        table_names = list(table_names)
+        with pg_errors_logged('etl.deferred_object'), closing(self._connection.cursor()) as _cursor:
+            _cursor.execute(
+                "SELECT con.conname AS name, 'content.' || cls.relname AS table_name, "
+                'pg_get_constraintdef(con.oid) AS definition '
+                'FROM pg_constraint con '
+                'JOIN pg_class cls ON cls.oid = con.conrelid '
+                'JOIN pg_namespace nsp ON nsp.oid = cls.relnamespace '
+                "WHERE con.contype = 'f' AND nsp.nspname = 'content' AND cls.relname = ANY(%s)",
+                (table_names,),
+            )
+            foreign_keys = _cursor.fetchall()
+            # Уникальные индексы и индексы, на которых держатся ограничения, остаются на месте
+            _cursor.execute(
+                "SELECT idx.relname AS name, 'content.' || cls.relname AS table_name, "
+                'pg_get_indexdef(ind.indexrelid) AS definition '
+                'FROM pg_index ind '
+                'JOIN pg_class idx ON idx.oid = ind.indexrelid '
+                'JOIN pg_class cls ON cls.oid = ind.indrelid '
+                'JOIN pg_namespace nsp ON nsp.oid = cls.relnamespace '
+                "WHERE nsp.nspname = 'content' AND cls.relname = ANY(%s) AND NOT ind.indisunique "
+                'AND NOT EXISTS (SELECT 1 FROM pg_constraint con WHERE con.conindid = ind.indexrelid)',
+                (table_names,),
+            )
+            indexes = _cursor.fetchall()
+            for kind, rows in ((FOREIGN_KEY, foreign_keys), (INDEX, indexes)):
+                for row in rows:
+                    _cursor.execute(
+                        'INSERT INTO etl.deferred_object (name, kind, table_name, definition) '
+                        'VALUES (%s, %s, %s, %s) ON CONFLICT (name) DO NOTHING',
+                        (row['name'], kind, row['table_name'], row['definition']),
+                    )
+                    if kind == FOREIGN_KEY:
+                        _cursor.execute(f'ALTER TABLE {row["table_name"]} DROP CONSTRAINT {row["name"]}')
+                    else:
+                        _cursor.execute(f'DROP INDEX content.{row["name"]}')
+                    logging.info('Снят %s %s на %s', kind, row['name'], row['table_name'])
+        self._connection.commit()
+
+    def pending(self, kind: str) -> list[dict]:
+        with pg_errors_logged('etl.deferred_object'), closing(self._connection.cursor()) as _cursor:
+            _cursor.execute(
+                'SELECT name, table_name, definition FROM etl.deferred_object WHERE kind = %s ORDER BY name',
+                (kind,),
+            )
+            return _cursor.fetchall()
+
+    def restore_index(self, name: str, definition: str):
+        with pg_errors_logged(name), closing(self._connection.cursor()) as _cursor:
+            _cursor.execute(f"SET maintenance_work_mem = '{MAINTENANCE_WORK_MEM}'")
+            _cursor.execute('SELECT to_regclass(%s) IS NOT NULL AS present', (f'content.{name}',))
+            if not _cursor.fetchone()['present']:
+                _cursor.execute(definition)
+            _cursor.execute('DELETE FROM etl.deferred_object WHERE name = %s', (name,))
+        self._connection.commit()
+
+    def add_foreign_key(self, name: str, table_name: str, definition: str):
+        """Ограничение без проверки существующих строк, блокировка держится недолго"""
+        with pg_errors_logged(table_name), closing(self._connection.cursor()) as _cursor:
+            _cursor.execute(
+                'SELECT 1 FROM pg_constraint WHERE conname = %s AND conrelid = %s::regclass',
+                (name, table_name),
+            )
+            if _cursor.fetchone() is None:
+                _cursor.execute(f'ALTER TABLE {table_name} ADD CONSTRAINT {name} {definition} NOT VALID')
+        self._connection.commit()
+
+    def validate_foreign_key(self, name: str, table_name: str):
+        """Проверка строк под SHARE UPDATE EXCLUSIVE, запись в таблицу при этом не блокируется"""
+        with pg_errors_logged(table_name), closing(self._connection.cursor()) as _cursor:
+            _cursor.execute(f'ALTER TABLE {table_name} VALIDATE CONSTRAINT {name}')
+            _cursor.execute('DELETE FROM etl.deferred_object WHERE name = %s', (name,))
+        self._connection.commit()
+
+
+def _restore_index(dsl: dict, name: str, definition: str):
+    with closing(connect_postgres(dsl)) as pg_conn:
+        DeferredObjects(pg_conn).restore_index(name, definition)
+    logging.info('Индекс %s перестроен', name)
+
+
+def _validate_foreign_keys(dsl: dict, table_name: str, names: list[str]):
+    # Проверки на одной таблице конфликтуют по блокировке, поэтому идут подряд
+    with closing(connect_postgres(dsl)) as pg_conn:
+        deferred = DeferredObjects(pg_conn)
+        for name in names:
+            deferred.validate_foreign_key(name, table_name)
+            logging.info('Ограничение %s на %s проверено', name, table_name)
+
+
+def _run_all(workers: int, tasks: list[tuple]) -> list[BaseException]:
+    """Выполнение всех задач, даже если часть из них упала"""
+    with ThreadPoolExecutor(workers) as pool:
+        futures = [pool.submit(*x) for x in tasks]
+    return [x.exception() for x in futures if x.exception() is not None]
+
+
+def restore_deferred(dsl: dict, workers: int = RESTORE_WORKERS):
+    """Восстановление всего, что записано в etl.deferred_object, в том числе после прошлых сбоев
+
+    Индексы строятся параллельно на отдельных соединениях. Внешние ключи сначала
+    добавляются как NOT VALID, затем проверяются через VALIDATE CONSTRAINT
+    параллельно по таблицам. Объект удаляется из etl.deferred_object только после
+    успешного восстановления, поэтому упавшее восстановление можно повторить.
+    """
+    with closing(connect_postgres(dsl)) as pg_conn:
+        DeferredObjects.create_table(pg_conn)
+        deferred = DeferredObjects(pg_conn)
+        indexes = deferred.pending(INDEX)
+        foreign_keys = deferred.pending(FOREIGN_KEY)
+    if not indexes and not foreign_keys:
+        return
+    logging.info('Восстановление: индексов %s, внешних ключей %s', len(indexes), len(foreign_keys))
+    # Внешние ключи ссылаются только на первичные ключи, поэтому восстанавливаются,
+    # даже если какой-то индекс построить не удалось
+    errors = _run_all(workers, [(_restore_index, dsl, x['name'], x['definition']) for x in indexes])
+
+    by_table = defaultdict(list)
+    with closing(connect_postgres(dsl)) as pg_conn:
+        deferred = DeferredObjects(pg_conn)
+        for foreign_key in foreign_keys:
+            deferred.add_foreign_key(foreign_key['name'], foreign_key['table_name'], foreign_key['definition'])
+            by_table[foreign_key['table_name']].append(foreign_key['name'])
+    errors += _run_all(workers, [(_validate_foreign_keys, dsl, x, y) for x, y in by_table.items()])
+    if errors:
+        logging.error('Не восстановлено объектов: %s, они остались в etl.deferred_object', len(errors))
+        raise errors[0]
+
+
+@contextmanager
+def bulk_load_mode(dsl: dict, table_names: Iterable[str], workers: int = RESTORE_WORKERS) -> Iterator[None]:
+    """Загрузка без вторичных индексов и внешних ключей с восстановлением в любом случае
+
+    Если упала сама загрузка, наружу уходит её исключение, а ошибка восстановления
+    записывается в лог и добавляется к нему примечанием.
+    """
+    with closing(connect_postgres(dsl)) as pg_conn:
+        DeferredObjects.create_table(pg_conn)
+        DeferredObjects(pg_conn).defer(table_names)
+    try:
+        yield
+    except BaseException as load_error:
+        try:
+            restore_deferred(dsl, workers)
+        except Exception as restore_error:
+            logging.exception('Восстановление после неудачной загрузки не завершено')
+            load_error.add_note(f'Восстановление индексов и ограничений не завершено: {restore_error!r}')
+        raise
+    restore_deferred(dsl, workers)
@@ -0,0 +1,90 @@
+from psycopg import connection as pg_connection
+from typing import Iterable, Optional, Tuple
+from contextlib import closing
+from pgsql_context_manager import pg_errors_logged
+
+
+class CheckpointStore:
+    """Хранилище последнего зафиксированного id по каждой таблице
+
+    Отметка пишется в той же транзакции, что и пачка данных, поэтому после сбоя
+    загрузка продолжается ровно с первой незафиксированной строки.
+    Для инкрементальной загрузки здесь же хранится верхняя граница updated_at
+    уже перенесённых изменений (synced_to) и граница текущего прохода (syncing_to).
+    """
+    _connection = None
+
+    def __init__(self, connection: pg_connection):
+        self._connection = connection
+
+    @staticmethod
+    def create_tables(connection: pg_connection):
+        """Создание таблиц отметок, вызывается один раз до запуска потоков загрузки:
+        одновременные CREATE ... IF NOT EXISTS в Postgres могут упасть на уникальности каталога
+        """
+        with pg_errors_logged('etl.checkpoint'), closing(connection.cursor()) as _cursor:
+            _cursor.execute('CREATE SCHEMA IF NOT EXISTS etl')
+            _cursor.execute(
+                'CREATE TABLE IF NOT EXISTS etl.checkpoint ('
+                'table_name TEXT PRIMARY KEY, '
+                'last_id TEXT NOT NULL, '
+                'modified timestamp with time zone NOT NULL DEFAULT now())'
+            )
+            _cursor.execute(
+                'CREATE TABLE IF NOT EXISTS etl.watermark ('
+                'table_name TEXT PRIMARY KEY, '
+                'synced_to TEXT, '
+                'syncing_to TEXT, '
+                'modified timestamp with time zone NOT NULL DEFAULT now())'
+            )
+        connection.commit()
+
+    def get(self, table_name: str) -> Optional[str]:
+        with pg_errors_logged('etl.checkpoint'), closing(self._connection.cursor()) as _cursor:
+            _cursor.execute('SELECT last_id FROM etl.checkpoint WHERE table_name = %s', (table_name,))
+            row = _cursor.fetchone()
+        return row['last_id'] if row else None
+
+    def commit_batch(self, table_name: str, last_id: str):
+        """Сохранение отметки и фиксация транзакции вместе с уже записанной пачкой"""
+        with pg_errors_logged('etl.checkpoint'), closing(self._connection.cursor()) as _cursor:
+            _cursor.execute(
+                'INSERT INTO etl.checkpoint (table_name, last_id) VALUES (%s, %s) '
+                'ON CONFLICT (table_name) DO UPDATE SET last_id = EXCLUDED.last_id, modified = now()',
+                (table_name, last_id),
+            )
+        self._connection.commit()
+
+    def commit(self):
+        self._connection.commit()
+
+    def reset(self, table_names: Iterable[str]):
+        with pg_errors_logged('etl.checkpoint'), closing(self._connection.cursor()) as _cursor:
+            _cursor.execute('DELETE FROM etl.checkpoint WHERE table_name = ANY(%s)', (list(table_names),))
+            _cursor.execute('DELETE FROM etl.watermark WHERE table_name = ANY(%s)', (list(table_names),))
+        self._connection.commit()
+
+    def get_watermark(self, table_name: str) -> Tuple[Optional[str], Optional[str]]:
+        with pg_errors_logged('etl.watermark'), closing(self._connection.cursor()) as _cursor:
+            _cursor.execute('SELECT synced_to, syncing_to FROM etl.watermark WHERE table_name = %s', (table_name,))
+            row = _cursor.fetchone()
+        return (row['synced_to'], row['syncing_to']) if row else (None, None)
+
+    def begin_sync(self, table_name: str, syncing_to: str):
+        """Запоминание границы прохода, фиксируется вместе с первой пачкой"""
+        with pg_errors_logged('etl.watermark'), closing(self._connection.cursor()) as _cursor:
+            _cursor.execute(
+                'INSERT INTO etl.watermark (table_name, syncing_to) VALUES (%s, %s) '
+                'ON CONFLICT (table_name) DO UPDATE SET syncing_to = EXCLUDED.syncing_to, modified = now()',
+                (table_name, syncing_to),
+            )
+
+    def finish_sync(self, table_name: str):
+        """Сдвиг отметки на границу завершённого прохода и сброс постраничной отметки таблицы"""
+        with pg_errors_logged('etl.watermark'), closing(self._connection.cursor()) as _cursor:
+            _cursor.execute(
+                'UPDATE etl.watermark SET synced_to = syncing_to, syncing_to = NULL, modified = now() '
+                'WHERE table_name = %s',
+                (table_name,),
+            )
+            _cursor.execute('DELETE FROM etl.checkpoint WHERE table_name = %s', (table_name,))
@@ -0,0 +1,208 @@
+import sqlite3
+import sys
+import logging
+from contextlib import closing
+from dataclasses import dataclass, field, fields
+from datetime import datetime, date, timezone
+from hashlib import md5
+from typing import Optional
+from uuid import UUID
+
+from psycopg import connection as pg_connection
+
+from row_converters import get_converter
+from sqlite_context_manger import connect_sqlite, source_columns
+
+# Диапазон, в котором строк не больше этого числа, сравнивается построчно
+LEAF_SIZE = 1000
+
+NULL_MARKER = '\\N'
+
+# Каноническое текстовое представление значения в Postgres, должно совпадать с canonical_value
+PG_CANONICAL = {
+    UUID: '{}::text',
+    str: '{}',
+    float: 'round({}::numeric, 6)::text',
+    date: "to_char({}, 'YYYY-MM-DD')",
+    datetime: "to_char({} AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS.US')",
+}
+
+
+def canonical_value(value) -> str:
+    if value is None:
+        return NULL_MARKER
+    if isinstance(value, float):
+        return f'{value:.6f}'
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.astimezone(timezone.utc).strftime('%Y-%m-%d %H:%M:%S.%f')
+    if isinstance(value, date):
+        return value.isoformat()
+    return str(value)
+
+
+def row_hash(canonical_row: str) -> int:
+    """Первые 8 байт md5 как знаковое 64-битное число, так же считает Postgres через bit(64)::bigint"""
+    return int.from_bytes(md5(canonical_row.encode()).digest()[:8], 'big', signed=True)
+
+
+class HashSum:
+    """Агрегат SQLite: сумма хэшей строк без переполнения, результат - текст"""
+
+    def __init__(self):
+        self.total = 0
+
+    def step(self, value: int):
+        self.total += value
+
+    def finalize(self) -> str:
+        return str(self.total)
+
+
+@dataclass
+class TableDiff:
+    table_name: str
+    # id, которые есть только в SQLite
+    missing: list[str] = field(default_factory=list)
+    # id, которые есть только в Postgres
+    extra: list[str] = field(default_factory=list)
+    # id, строки которых отличаются
+    changed: list[str] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return not (self.missing or self.extra or self.changed)
+
+
+class ConsistencyChecker:
+    """Сверка таблиц SQLite и Postgres по хэшам диапазонов id
+
+    Диапазоны задаются префиксом шестнадцатеричной записи id: если сумма хэшей
+    диапазона совпала, он не проверяется дальше, иначе делится на 16 поддиапазонов.
+    Построчно сравниваются только небольшие расходящиеся диапазоны.
+    """
+
+    def __init__(self, sqlite_conn: sqlite3.Connection, pg_conn: pg_connection, leaf_size: int = LEAF_SIZE):
+        self._sqlite_conn = sqlite_conn
+        self._pg_conn = pg_conn
+        self._leaf_size = leaf_size
+        self._sqlite_conn.create_aggregate('hash_sum', 1, HashSum)
+
+    def _prepare(self, table_name: str, row_class: dataclass) -> tuple[str, str]:
+        """Выражения хэша строки для SQLite и Postgres"""
+        convert = get_converter(row_class)
+
+        def sqlite_row_hash(*values) -> int:
+            return row_hash('\t'.join(canonical_value(x) for x in convert(values)))
+
+        self._sqlite_conn.create_function(f'row_hash_{table_name}', len(fields(row_class)), sqlite_row_hash, deterministic=True)
+        sqlite_columns = ', '.join(source_columns(self._sqlite_conn, table_name, row_class))
+        pg_columns = ', '.join(
+            f"coalesce({PG_CANONICAL[x.type].format(x.name)}, '{NULL_MARKER}')" for x in fields(row_class)
+        )
+        sqlite_hash = f'row_hash_{table_name}({sqlite_columns})'
+        pg_hash = f"('x' || substr(md5(concat_ws(E'\\t', {pg_columns})), 1, 16))::bit(64)::bigint"
+        return sqlite_hash, pg_hash
+
+    @staticmethod
+    def _bounds(prefix: str) -> tuple[Optional[str], Optional[str]]:
+        if not prefix:
+            return None, None
+        shift = 4 * (32 - len(prefix))
+        low = int(prefix, 16)
+        upper = (low + 1) << shift
+        return str(UUID(int=low << shift)), str(UUID(int=upper)) if upper < 1 << 128 else None
+
+    @staticmethod
+    def _range_condition(low: Optional[str], high: Optional[str], cast: str = '') -> tuple[str, tuple]:
+        conditions, params = ['TRUE' if cast else '1'], []
+        if low is not None:
+            conditions.append(f'id >= {"%s" if cast else "?"}{cast}')
+            params.append(low)
+        if high is not None:
+            conditions.append(f'id < {"%s" if cast else "?"}{cast}')
+            params.append(high)
+        return ' AND '.join(conditions), tuple(params)
+
+    def _bucket_hashes(self, table_name: str, hashes: tuple[str, str], prefix: str, depth: int) -> tuple[dict, dict]:
+        """Число строк и сумма хэшей внутри префикса prefix с группировкой по первым depth символам id"""
+        sqlite_hash, pg_hash = hashes
+        low, high = self._bounds(prefix)
+        where, params = self._range_condition(low, high)
+        with closing(self._sqlite_conn.cursor()) as _cursor:
+            _cursor.execute(
+                f"SELECT substr(replace(id, '-', ''), 1, ?), count(*), hash_sum({sqlite_hash}) "
+                f'FROM {table_name} WHERE {where} GROUP BY 1',
+                (depth, *params),
+            )
+            sqlite_buckets = {x[0]: (x[1], int(x[2])) for x in _cursor.fetchall()}
+        where, params = self._range_condition(low, high, '::uuid')
+        with closing(self._pg_conn.cursor()) as _cursor:
+            _cursor.execute(
+                f"SELECT substr(replace(id::text, '-', ''), 1, %s) AS bucket, count(*) AS rows_cnt, "
+                f'sum({pg_hash}) AS hash FROM content.{table_name} WHERE {where} GROUP BY 1',
+                (depth, *params),
+            )
+            pg_buckets = {x['bucket']: (x['rows_cnt'], int(x['hash'])) for x in _cursor.fetchall()}
+        return sqlite_buckets, pg_buckets
+
+    def _compare_rows(self, table_name: str, hashes: tuple[str, str], prefix: str, diff: TableDiff):
+        sqlite_hash, pg_hash = hashes
+        low, high = self._bounds(prefix)
+        where, params = self._range_condition(low, high)
+        with closing(self._sqlite_conn.cursor()) as _cursor:
+            _cursor.execute(f'SELECT id, {sqlite_hash} FROM {table_name} WHERE {where}', params)
+            sqlite_rows = {str(UUID(x[0])): x[1] for x in _cursor.fetchall()}
+        where, params = self._range_condition(low, high, '::uuid')
+        with closing(self._pg_conn.cursor()) as _cursor:
+            _cursor.execute(f'SELECT id::text AS id, {pg_hash} AS hash FROM content.{table_name} WHERE {where}', params)
+            pg_rows = {x['id']: x['hash'] for x in _cursor.fetchall()}
+        diff.missing.extend(sorted(sqlite_rows.keys() - pg_rows.keys()))
+        diff.extra.extend(sorted(pg_rows.keys() - sqlite_rows.keys()))
+        diff.changed.extend(sorted(x for x in sqlite_rows.keys() & pg_rows.keys() if sqlite_rows[x] != pg_rows[x]))
+
+    def _check_range(self, table_name: str, hashes: tuple[str, str], prefix: str, depth: int, diff: TableDiff):
+        sqlite_buckets, pg_buckets = self._bucket_hashes(table_name, hashes, prefix, depth)
+        for bucket in sorted(sqlite_buckets.keys() | pg_buckets.keys()):
+            sqlite_bucket = sqlite_buckets.get(bucket, (0, 0))
+            pg_bucket = pg_buckets.get(bucket, (0, 0))
+            if sqlite_bucket == pg_bucket:
+                continue
+            if max(sqlite_bucket[0], pg_bucket[0]) <= self._leaf_size or len(bucket) == 32:
+                self._compare_rows(table_name, hashes, bucket, diff)
+            else:
+                self._check_range(table_name, hashes, bucket, len(bucket) + 1, diff)
+
+    def check_table(self, table_name: str, row_class: dataclass) -> TableDiff:
+        diff = TableDiff(table_name)
+        # Корень дерева - вся таблица одним диапазоном с пустым префиксом
+        self._check_range(table_name, self._prepare(table_name, row_class), '', 0, diff)
+        return diff
+
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+    from data_loader import connect_postgres, dsl_from_env, tables_for_load
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+    dsl = dsl_from_env()
+    sqlite_path = sys.argv[1] if len(sys.argv) > 1 else 'db.sqlite'
+    consistent = True
+    with closing(connect_sqlite(sqlite_path)) as sqlite_conn, closing(connect_postgres(dsl)) as pg_conn:
+        checker = ConsistencyChecker(sqlite_conn, pg_conn)
+        for table_name, table_class in tables_for_load.items():
+            diff = checker.check_table(table_name, table_class)
+            if diff.ok:
+                logging.info('Таблица %s совпадает', table_name)
+                continue
+            consistent = False
+            logging.error(
+                'Таблица %s расходится: нет в Postgres %s, лишние %s, отличаются %s',
+                table_name, len(diff.missing), len(diff.extra), len(diff.changed),
+            )
+            for kind, ids in (('нет в Postgres', diff.missing), ('лишняя', diff.extra), ('отличается', diff.changed)):
+                for row_id in ids:
+                    logging.error('  %s %s: %s', table_name, kind, row_id)
+    sys.exit(0 if consistent else 1)
@@ -1,11 +1,23 @@
-from typing import Union
+from typing import Optional, Union
 from db_data_classes import FilmWork, Person, Genre, GenreFilmWork, PersonFilmWork
-from pgsql_context_manager import PostgresSaver
-from sqlite_context_manger import SQLiteLoader
+from pgsql_context_manager import PostgresSaver, Quarantine, WRITER_COPY
+from sqlite_context_manger import MergedSQLiteLoader, SQLiteLoader, connect_sqlite, read_ahead
+from checkpoint_store import CheckpointStore
+from batch_sizer import BatchSizer, MEMORY_LIMIT, batch_bytes
+from metrics import RunMetrics
+import json
+import os
 import sqlite3
-from psycopg import connection as pg_connection
+import time
+from dataclasses import dataclass, field
+from contextlib import ExitStack, closing, nullcontext
+from concurrent.futures import FIRST_COMPLETED, Executor, ProcessPoolExecutor, ThreadPoolExecutor, wait
+import psycopg
+from psycopg import ClientCursor, connection as pg_connection
+from psycopg.rows import dict_row
 import logging
 
+# Начальный размер пачки, дальше он подбирается по таблице
 BATCH_SIZE = 100
 
 
@@ -19,13 +31,268 @@ tables_for_load = {
     'person_film_work': PersonFilmWork,
 }
 
+# Зависимости таблиц по внешним ключам, таблица грузится только после своих родителей
+table_dependencies = {
+    'genre_film_work': ('film_work', 'genre'),
+    'person_film_work': ('film_work', 'person'),
+}
 
-def load_from_sqlite(sqlite_conn: sqlite3.Connection, pg_conn: pg_connection, tables_for_load: dict[str, Union[FilmWork, Person, Genre, GenreFilmWork, PersonFilmWork]]):
-    """Основной метод загрузки данных из SQLite в Postgres"""
-    postgres_saver = PostgresSaver(pg_conn)
-    sqlite_loader = SQLiteLoader(sqlite_conn, BATCH_SIZE)
+# Таблицы, строки которых можно отобрать по фильму (--by-film)
+film_tables = ('film_work', *(x for x, y in table_dependencies.items() if 'film_work' in y))
 
-    for table_name, table_class in tables_for_load.items():
+# Столбец SQLite, по которому инкрементальная загрузка отбирает изменённые строки,
+# в таблицах связей строки не изменяются, поэтому берётся время создания
+watermark_columns = {
+    'film_work': 'updated_at',
+    'person': 'updated_at',
+    'genre': 'updated_at',
+    'genre_film_work': 'created_at',
+    'person_film_work': 'created_at',
+}
+
+
+@dataclass
+class RowFilter:
+    """Отбор строк для частичной перезагрузки, условие выполняется в запросе к SQLite
+
+    id_from, id_to - диапазон id включительно
+    ids - явный список id
+    changed_from, changed_to - окно по столбцу из watermark_columns: [changed_from, changed_to)
+    by_film - в таблицах связей отбирать по фильму: условия на id и окно применяются
+    к film_work_id и к строкам film_work, на которые он ссылается. Годится только для
+    таблиц из film_tables: у персон и жанров нет своего фильма
+    """
+    id_from: Optional[str] = None
+    id_to: Optional[str] = None
+    ids: Optional[list[str]] = None
+    changed_from: Optional[str] = None
+    changed_to: Optional[str] = None
+    by_film: bool = False
+
+    def _id_conditions(self, column: str) -> tuple[list[str], list]:
+        conditions, params = [], []
+        if self.id_from is not None:
+            conditions.append(f'{column} >= ?')
+            params.append(self.id_from)
+        if self.id_to is not None:
+            conditions.append(f'{column} <= ?')
+            params.append(self.id_to)
+        if self.ids is not None:
+            # Список любой длины передаётся одним параметром, SQLite разворачивает его через json_each
+            conditions.append(f'{column} IN (SELECT value FROM json_each(?))')
+            params.append(json.dumps(self.ids))
+        return conditions, params
+
+    def _window_conditions(self, column: str) -> tuple[list[str], list]:
+        conditions, params = [], []
+        if self.changed_from is not None:
+            conditions.append(f'{column} >= ?')
+            params.append(self.changed_from)
+        if self.changed_to is not None:
+            conditions.append(f'{column} < ?')
+            params.append(self.changed_to)
+        return conditions, params
+
+    def condition(self, table_name: str) -> tuple[str, tuple]:
+        if self.by_film and table_name not in film_tables:
+            raise ValueError(f'Отбор по фильму неприменим к таблице {table_name}')
+        if self.by_film and table_name != 'film_work':
+            conditions, params = self._id_conditions('film_work_id')
+            window, window_params = self._window_conditions(watermark_columns['film_work'])
+            if window:
+                conditions.append(f'film_work_id IN (SELECT id FROM film_work WHERE {" AND ".join(window)})')
+                params += window_params
+        else:
+            conditions, params = self._id_conditions('id')
+            window, window_params = self._window_conditions(watermark_columns[table_name])
+            conditions += window
+            params += window_params
+        return ' AND '.join(conditions), tuple(params)
+
+
+@dataclass
+class LoadOptions:
+    """Настройки переноса
+
+    writer - способ записи: WRITER_COPY (бинарный COPY через промежуточную таблицу)
+    или WRITER_INSERT (построчный executemany, запасной вариант)
+    resumable - фиксировать каждую пачку с отметкой в etl.checkpoint и продолжать с неё после сбоя
+    incremental - переносить только изменения после прошлого прохода, обновляя существующие строки
+    batch_sizes - закреплённые размеры пачек по таблицам, для остальных размер подбирается на ходу
+    memory_limit - бюджет памяти на пачку в байтах
+    pipelined - читать SQLite в отдельном потоке параллельно с записью в Postgres,
+    запись через INSERT идёт в режиме конвейера psycopg
+    metrics - сбор времени стадий и счётчиков по таблицам
+    quarantine - строки с ошибками данных откладывать в etl.quarantine, а не прерывать загрузку,
+    каждая пачка при этом фиксируется отдельно
+    row_filter - переносить только отобранные строки, существующие строки при этом обновляются
+    """
+    writer: str = WRITER_COPY
+    resumable: bool = False
+    incremental: bool = False
+    batch_sizes: dict[str, int] = field(default_factory=dict)
+    memory_limit: int = MEMORY_LIMIT
+    pipelined: bool = False
+    metrics: Optional[RunMetrics] = None
+    quarantine: bool = False
+    row_filter: Optional[RowFilter] = None
+
+
+def dsl_from_env() -> dict:
+    """Параметры подключения к Postgres из переменных окружения DB_*"""
+    return {
+        'dbname': os.getenv('DB_NAME'),
+        'user': os.getenv('DB_USER'),
+        'password': os.getenv('DB_PASSWORD'),
+        'host': os.getenv('DB_HOST'),
+        'port': os.getenv('DB_PORT'),
+    }
+
+
+def connect_postgres(dsl: dict) -> pg_connection:
+    return psycopg.connect(**dsl, row_factory=dict_row, cursor_factory=ClientCursor)
+
+
+def create_etl_tables(pg_conn: pg_connection, options: LoadOptions):
+    """Служебные таблицы схемы etl, нужные для выбранных настроек"""
+    if options.resumable or options.incremental:
+        CheckpointStore.create_tables(pg_conn)
+    if options.quarantine:
+        Quarantine.create_table(pg_conn)
+
+
+def create_saver(pg_conn: pg_connection, options: LoadOptions) -> PostgresSaver:
+    quarantine = Quarantine(pg_conn) if options.quarantine else None
+    # Частичная перезагрузка должна перезаписать строки, уже лежащие в Postgres
+    upsert = options.incremental or options.row_filter is not None
+    return PostgresSaver(pg_conn, options.writer, upsert=upsert, quarantine=quarantine, metrics=options.metrics)
+
+
+def load_table(sqlite_loader: SQLiteLoader, postgres_saver: PostgresSaver, table_name: str, table_class: Union[FilmWork, Person, Genre, GenreFilmWork, PersonFilmWork], options: LoadOptions, checkpoint_store: Optional[CheckpointStore] = None):
+    """Перенос одной таблицы
+
+    С options.resumable каждая пачка фиксируется вместе с отметкой в checkpoint_store,
+    с options.quarantine - сама по себе,
+    с options.incremental переносятся только строки, изменённые после прошлого прохода.
+    """
+    where, params = '', ()
+    if options.incremental:
+        column = watermark_columns[table_name]
+        synced_to, syncing_to = checkpoint_store.get_watermark(table_name)
+        if syncing_to is None:
+            # Граница фиксируется в начале прохода, строки, изменённые во время загрузки, попадут в следующий
+            syncing_to = sqlite_loader.max_value(table_name, column)
+            if syncing_to is None:
+                logging.info('Таблица %s пуста', table_name)
+                return
+            checkpoint_store.begin_sync(table_name, syncing_to)
+        if synced_to is None:
+            where, params = f'{column} <= ? OR {column} IS NULL', (syncing_to,)
+        else:
+            where, params = f'{column} > ? AND {column} <= ?', (synced_to, syncing_to)
+        logging.info('Перенос изменений таблицы %s с %s по %s', table_name, synced_to, syncing_to)
+
+    if options.row_filter:
+        condition, condition_params = options.row_filter.condition(table_name)
+        if condition:
+            where, params = f'({where}) AND {condition}' if where else condition, params + condition_params
+            logging.info('Таблица %s: отбор %s', table_name, condition)
+
+    after_id = checkpoint_store.get(table_name) if options.resumable else None
+    if after_id:
+        logging.info('Перенос данных таблицы %s с id > %s', table_name, after_id)
+    elif not options.incremental:
         logging.info('Перенос данных таблицы %s', table_name)
-        for batch in sqlite_loader.transform_data(table_name, table_class):
+
+    pinned_size = options.batch_sizes.get(table_name)
+    batch_sizer = BatchSizer(table_name, pinned_size or BATCH_SIZE, options.memory_limit, adaptive=pinned_size is None)
+    batches = sqlite_loader.transform_data(table_name, table_class, after_id, where, params, batch_sizer)
+    if options.quarantine:
+        # Упавшая пачка откатывается целиком, в транзакции не должно быть ничего, кроме неё
+        postgres_saver.commit()
+    with postgres_saver.pipeline() if options.pipelined else nullcontext():
+        if options.pipelined:
+            batches = read_ahead(batches)
+        started = time.perf_counter()
+        for batch in batches:
+            load_started = time.perf_counter()
             postgres_saver.save_data(batch, table_name, table_class)
+            if options.resumable:
+                checkpoint_store.commit_batch(table_name, str(batch[-1][0]))
+            elif options.quarantine:
+                postgres_saver.commit()
+            finished = time.perf_counter()
+            nbytes = batch_bytes(batch)
+            batch_sizer.record(len(batch), nbytes, finished - started)
+            if options.metrics:
+                options.metrics.observe(table_name, 'load', finished - load_started)
+                options.metrics.record_batch(table_name, len(batch), nbytes)
+            started = finished
+    batch_sizer.log_summary()
+
+    if options.incremental:
+        checkpoint_store.finish_sync(table_name)
+        if options.resumable or options.quarantine:
+            checkpoint_store.commit()
+
+
+def create_loader(sqlite_conn: Union[sqlite3.Connection, list[sqlite3.Connection]], options: LoadOptions, executor: Optional[Executor] = None) -> Union[SQLiteLoader, MergedSQLiteLoader]:
+    """Загрузчик одного файла SQLite или слияния нескольких файлов с дедупликацией по id"""
+    if isinstance(sqlite_conn, sqlite3.Connection):
+        sqlite_conn = [sqlite_conn]
+    if len(sqlite_conn) == 1:
+        return SQLiteLoader(sqlite_conn[0], BATCH_SIZE, executor, options.metrics)
+    return MergedSQLiteLoader(sqlite_conn, BATCH_SIZE, executor, options.metrics)
+
+
+def load_from_sqlite(sqlite_conn: Union[sqlite3.Connection, list[sqlite3.Connection]], pg_conn: pg_connection, tables_for_load: dict[str, Union[FilmWork, Person, Genre, GenreFilmWork, PersonFilmWork]], options: Optional[LoadOptions] = None):
+    """Основной метод загрузки данных из SQLite в Postgres, источников может быть несколько"""
+    options = options or LoadOptions()
+    create_etl_tables(pg_conn, options)
+    postgres_saver = create_saver(pg_conn, options)
+    sqlite_loader = create_loader(sqlite_conn, options)
+    checkpoint_store = CheckpointStore(pg_conn) if options.resumable or options.incremental else None
+
+    for table_name, table_class in tables_for_load.items():
+        load_table(sqlite_loader, postgres_saver, table_name, table_class, options, checkpoint_store)
+
+
+def _load_table_in_thread(sqlite_paths: list[str], dsl: dict, table_name: str, table_class: Union[FilmWork, Person, Genre, GenreFilmWork, PersonFilmWork], options: LoadOptions, executor: Executor):
+    """Загрузка одной таблицы на собственных соединениях, каждая таблица фиксируется отдельно"""
+    with ExitStack() as stack:
+        sqlite_conns = [stack.enter_context(closing(connect_sqlite(x))) for x in sqlite_paths]
+        pg_conn = stack.enter_context(closing(connect_postgres(dsl)))
+        checkpoint_store = CheckpointStore(pg_conn) if options.resumable or options.incremental else None
+        load_table(
+            create_loader(sqlite_conns, options, executor), create_saver(pg_conn, options),
+            table_name, table_class, options, checkpoint_store,
+        )
+        pg_conn.commit()
+
+
+def load_from_sqlite_parallel(sqlite_path: Union[str, list[str]], dsl: dict, tables_for_load: dict[str, Union[FilmWork, Person, Genre, GenreFilmWork, PersonFilmWork]], options: Optional[LoadOptions] = None, max_workers: Optional[int] = None):
+    """Параллельная загрузка независимых таблиц с учётом графа зависимостей
+
+    Таблица запускается, как только загружены все её родители из table_dependencies,
+    преобразование строк выполняется в пуле процессов.
+    """
+    options = options or LoadOptions()
+    sqlite_paths = [sqlite_path] if isinstance(sqlite_path, str) else sqlite_path
+    with closing(connect_postgres(dsl)) as pg_conn:
+        create_etl_tables(pg_conn, options)
+    loaded, running = set(), {}
+    with ThreadPoolExecutor(max_workers or len(tables_for_load)) as table_pool, ProcessPoolExecutor() as transform_pool:
+        while len(loaded) < len(tables_for_load):
+            for table_name, table_class in tables_for_load.items():
+                if table_name in loaded or table_name in running.values():
+                    continue
+                parents = [x for x in table_dependencies.get(table_name, ()) if x in tables_for_load]
+                if all(x in loaded for x in parents):
+                    future = table_pool.submit(_load_table_in_thread, sqlite_paths, dsl, table_name, table_class, options, transform_pool)
+                    running[future] = table_name
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                table_name = running.pop(future)
+                future.result()
+                loaded.add(table_name)
+                logging.info('Таблица %s загружена', table_name)
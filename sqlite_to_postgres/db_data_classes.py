@@ -19,6 +19,9 @@ class FilmWork:
     def __post_init__(self):
         if isinstance(self.id, str):
             self.id = UUID(self.id)
+        # бинарный COPY требует настоящую дату, а SQLite отдаёт строку
+        if isinstance(self.creation_date, str):
+            self.creation_date = date.fromisoformat(self.creation_date)
         if isinstance(self.created, str):
             self.created = datetime.fromisoformat(self.created)
         if isinstance(self.modified, str):
@@ -0,0 +1,99 @@
+import json
+import logging
+import sqlite3
+import time
+from contextlib import closing
+from typing import Optional, Union
+
+from psycopg import connection as pg_connection
+
+from batch_sizer import BatchSizer
+from data_loader import BATCH_SIZE, LoadOptions, create_loader
+from db_data_classes import FilmWork, Person, Genre, GenreFilmWork, PersonFilmWork
+from pgsql_context_manager import PostgresSaver, pg_errors_logged
+
+# Сколько строк каждой таблицы проходит через чтение, преобразование и пробную запись
+SAMPLE_ROWS = 20_000
+# Пробные таблицы создаются в отдельной схеме внутри транзакции, которая откатывается
+DRY_RUN_SCHEMA = 'etl_dry_run'
+
+
+def _projection(total_rows: int, sample_rows: int, value: float) -> float:
+    return value * total_rows / sample_rows if sample_rows else 0.0
+
+
+def estimate_table(sqlite_conns: list[sqlite3.Connection], pg_conn: pg_connection, table_name: str, table_class: Union[FilmWork, Person, Genre, GenreFilmWork, PersonFilmWork], options: LoadOptions) -> dict:
+    """Замер одной таблицы на выборке и пересчёт на полный объём
+
+    Выборка - первые по id строки; id - случайные uuid, поэтому она представительна.
+    Внешние ключи в пробную таблицу не копируются, их проверка в оценку не входит.
+    """
+    total_rows = sum(x.execute(f'SELECT count(*) FROM {table_name}').fetchone()[0] for x in sqlite_conns)
+    batch_sizer = BatchSizer(table_name, options.batch_sizes.get(table_name, BATCH_SIZE), options.memory_limit, adaptive=False)
+
+    sample, started = [], time.perf_counter()
+    with closing(create_loader(sqlite_conns, options).transform_data(table_name, table_class, batch_sizer=batch_sizer)) as batches:
+        for batch in batches:
+            sample.append(batch)
+            if sum(len(x) for x in sample) >= SAMPLE_ROWS:
+                break
+    read_seconds = time.perf_counter() - started
+    sample_rows = sum(len(x) for x in sample)
+
+    postgres_saver = PostgresSaver(pg_conn, options.writer, upsert=options.incremental, schema=DRY_RUN_SCHEMA)
+    with pg_errors_logged(table_name), closing(pg_conn.cursor()) as _cursor:
+        _cursor.execute(f'CREATE TABLE {DRY_RUN_SCHEMA}.{table_name} (LIKE content.{table_name} INCLUDING ALL)')
+        _cursor.execute('SELECT pg_current_wal_insert_lsn() AS lsn')
+        wal_start = _cursor.fetchone()['lsn']
+        started = time.perf_counter()
+        for batch in sample:
+            postgres_saver.save_data(batch, table_name, table_class)
+        write_seconds = time.perf_counter() - started
+        _cursor.execute(
+            'SELECT pg_wal_lsn_diff(pg_current_wal_insert_lsn(), %s) AS wal, '
+            'pg_table_size(%s::regclass) AS table_size, pg_indexes_size(%s::regclass) AS indexes_size',
+            (wal_start, f'{DRY_RUN_SCHEMA}.{table_name}', f'{DRY_RUN_SCHEMA}.{table_name}'),
+        )
+        sizes = _cursor.fetchone()
+
+    read_total = _projection(total_rows, sample_rows, read_seconds)
+    write_total = _projection(total_rows, sample_rows, write_seconds)
+    return {
+        'table': table_name,
+        'rows': total_rows,
+        'sample_rows': sample_rows,
+        'read_rows_per_second': round(sample_rows / read_seconds) if read_seconds else None,
+        'write_rows_per_second': round(sample_rows / write_seconds) if write_seconds else None,
+        # При конвейерной загрузке чтение идёт одновременно с записью
+        'seconds': round(max(read_total, write_total) if options.pipelined else read_total + write_total, 1),
+        'wal_bytes': round(_projection(total_rows, sample_rows, float(sizes['wal']))),
+        'table_bytes': round(_projection(total_rows, sample_rows, sizes['table_size'])),
+        'index_bytes': round(_projection(total_rows, sample_rows, sizes['indexes_size'])),
+    }
+
+
+def estimate(sqlite_conns: list[sqlite3.Connection], pg_conn: pg_connection, tables_for_load: dict[str, Union[FilmWork, Person, Genre, GenreFilmWork, PersonFilmWork]], options: Optional[LoadOptions] = None) -> dict:
+    """Пробный прогон без изменения content.*: все пробные таблицы откатываются вместе с транзакцией"""
+    options = options or LoadOptions()
+    try:
+        with pg_errors_logged(DRY_RUN_SCHEMA), closing(pg_conn.cursor()) as _cursor:
+            _cursor.execute(f'CREATE SCHEMA {DRY_RUN_SCHEMA}')
+        tables = [estimate_table(sqlite_conns, pg_conn, x, y, options) for x, y in tables_for_load.items()]
+    finally:
+        pg_conn.rollback()
+    report = {
+        'tables': tables,
+        'total': {x: sum(y[x] for y in tables) for x in ('rows', 'seconds', 'wal_bytes', 'table_bytes', 'index_bytes')},
+    }
+    for table in (*tables, {'table': 'всего', **report['total']}):
+        logging.info(
+            'Оценка %s: %s строк, %s с, WAL %.1f МБ, таблица %.1f МБ, индексы %.1f МБ',
+            table['table'], table['rows'], table['seconds'], table['wal_bytes'] / 2 ** 20,
+            table['table_bytes'] / 2 ** 20, table['index_bytes'] / 2 ** 20,
+        )
+    return report
+
+
+def write_report(report: dict, path: str):
+    with open(path, 'w') as report_file:
+        json.dump(report, report_file, ensure_ascii=False, indent=2)
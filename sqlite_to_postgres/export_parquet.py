@@ -0,0 +1,92 @@
+import argparse
+import logging
+import os
+import time
+from contextlib import closing
+from dataclasses import dataclass, fields
+from datetime import datetime, date
+from uuid import UUID
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from dotenv import load_dotenv
+from psycopg import IsolationLevel, connection as pg_connection
+from psycopg.rows import tuple_row
+
+from data_loader import connect_postgres, dsl_from_env, tables_for_load
+
+# Строк в одной группе Parquet, столько же строк за раз держится в памяти
+ROW_GROUP_SIZE = 100_000
+COMPRESSION = 'zstd'
+
+# Типы столбцов Arrow по типам полей датаклассов, uuid выгружается текстом
+ARROW_TYPES = {
+    UUID: pa.string(),
+    str: pa.string(),
+    float: pa.float64(),
+    date: pa.date32(),
+    datetime: pa.timestamp('us', tz='UTC'),
+}
+
+
+def arrow_schema(row_class: dataclass) -> pa.Schema:
+    return pa.schema([pa.field(x.name, ARROW_TYPES[x.type]) for x in fields(row_class)])
+
+
+def select_query(table_name: str, row_class: dataclass) -> str:
+    # uuid приводится к тексту на сервере, чтобы не создавать объект UUID на каждое значение
+    columns = ', '.join(f'{x.name}::text' if x.type is UUID else x.name for x in fields(row_class))
+    return f'SELECT {columns} FROM content.{table_name}'
+
+
+def export_table(pg_conn: pg_connection, table_name: str, row_class: dataclass, path: str, row_group_size: int = ROW_GROUP_SIZE) -> int:
+    """Выгрузка таблицы серверным курсором группами по row_group_size строк
+
+    Файл пишется рядом под временным именем и переименовывается после записи
+    последней группы, поэтому читатели не видят недописанных снимков.
+    """
+    schema = arrow_schema(row_class)
+    tmp_path = f'{path}.tmp'
+    rows_count = 0
+    with closing(pg_conn.cursor(name=f'export_{table_name}', row_factory=tuple_row)) as _cursor, \
+            pq.ParquetWriter(tmp_path, schema, compression=COMPRESSION) as writer:
+        _cursor.execute(select_query(table_name, row_class))
+        while rows := _cursor.fetchmany(row_group_size):
+            columns = zip(*rows)
+            writer.write_table(
+                pa.Table.from_arrays([pa.array(x, y.type) for x, y in zip(columns, schema)], schema=schema),
+                row_group_size=row_group_size,
+            )
+            rows_count += len(rows)
+    os.replace(tmp_path, path)
+    return rows_count
+
+
+def export_snapshot(dsl: dict, output_dir: str, tables: dict[str, dataclass] = tables_for_load, row_group_size: int = ROW_GROUP_SIZE):
+    """Снимок всех таблиц в одной транзакции REPEATABLE READ только для чтения
+
+    Все файлы соответствуют одному моменту времени, связи между таблицами согласованы.
+    Транзакция держит горизонт очистки, поэтому выгрузку лучше направлять на реплику.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    with closing(connect_postgres(dsl)) as pg_conn:
+        pg_conn.isolation_level = IsolationLevel.REPEATABLE_READ
+        pg_conn.read_only = True
+        with pg_conn.transaction():
+            for table_name, row_class in tables.items():
+                started = time.perf_counter()
+                path = os.path.join(output_dir, f'{table_name}.parquet')
+                rows_count = export_table(pg_conn, table_name, row_class, path, row_group_size)
+                logging.info('Таблица %s: %s строк за %.1f с в %s', table_name, rows_count, time.perf_counter() - started, path)
+
+
+if __name__ == '__main__':
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+    parser = argparse.ArgumentParser(description='Выгрузка схемы content в файлы Parquet')
+    parser.add_argument('--output-dir', default='export', help='каталог для файлов снимка')
+    parser.add_argument('--row-group-size', type=int, default=ROW_GROUP_SIZE,
+                        help='строк в группе Parquet, определяет расход памяти')
+    args = parser.parse_args()
+    dsl = dsl_from_env()
+    export_snapshot(dsl, args.output_dir, row_group_size=args.row_group_size)
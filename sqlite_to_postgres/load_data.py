@@ -1,13 +1,22 @@
-import os
+import argparse
+import asyncio
 import sqlite3
-from contextlib import closing
+import sys
+from contextlib import ExitStack, closing, nullcontext
+from typing import Optional
 
 import psycopg
-from psycopg import ClientCursor
-from psycopg.rows import dict_row
 from psycopg import errors as pg_errors
 
-from data_loader import load_from_sqlite, tables_for_load
+from data_loader import LoadOptions, RowFilter, connect_postgres, dsl_from_env, load_from_sqlite, load_from_sqlite_parallel, film_tables, tables_for_load
+from pgsql_context_manager import WRITER_COPY, WRITER_INSERT
+from checkpoint_store import CheckpointStore
+from async_loader import CONNECTIONS, load_from_sqlite_async
+from sqlite_context_manger import connect_sqlite
+from metrics import RunMetrics
+from bulk_load import bulk_load_mode, restore_deferred
+from preflight import validate_links
+from estimator import estimate, write_report
 
 import logging
 
@@ -18,23 +27,155 @@ logger = logging.getLogger(__name__)
 FORMAT = '%(asctime)s %(levelname)s: %(message)s'
 logging.basicConfig(level=logging.INFO, format=FORMAT)
 
+SQLITE_PATH = 'db.sqlite'
+
+
+def parse_batch_sizes(value: str) -> dict[str, int]:
+    """Разбор закреплённых размеров пачек вида film_work=500,person_film_work=20000"""
+    batch_sizes = {}
+    for item in value.split(','):
+        table_name, _, size = item.partition('=')
+        if table_name not in tables_for_load or not size.isdigit():
+            raise argparse.ArgumentTypeError(f'Некорректный размер пачки: {item}')
+        batch_sizes[table_name] = int(size)
+    return batch_sizes
+
+
+def read_ids(path: str) -> list[str]:
+    """Список id из файла: по одному в строке, пустые строки и строки с # пропускаются"""
+    with open(path) as ids_file:
+        return [x.strip() for x in ids_file if x.strip() and not x.lstrip().startswith('#')]
+
+
+def build_row_filter(args: argparse.Namespace) -> Optional[RowFilter]:
+    row_filter = RowFilter(
+        id_from=args.id_from,
+        id_to=args.id_to,
+        ids=read_ids(args.ids_file) if args.ids_file else None,
+        changed_from=args.changed_from,
+        changed_to=args.changed_to,
+        by_film=args.by_film,
+    )
+    return row_filter if row_filter != RowFilter(by_film=args.by_film) else None
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Перенос данных из SQLite в Postgres')
+    parser.add_argument('--sqlite', nargs='+', default=[SQLITE_PATH],
+                        help='файлы SQLite; из нескольких файлов строки с одинаковым id берутся с самым поздним updated_at')
+    parser.add_argument('--tables', nargs='+', choices=list(tables_for_load), default=list(tables_for_load),
+                        help='переносить только эти таблицы')
+    parser.add_argument('--id-from', help='частичная перезагрузка: id не меньше этого')
+    parser.add_argument('--id-to', help='частичная перезагрузка: id не больше этого')
+    parser.add_argument('--ids-file', help='частичная перезагрузка: файл со списком id, по одному в строке')
+    parser.add_argument('--changed-from',
+                        help='частичная перезагрузка: updated_at (created_at в таблицах связей) не раньше, например 2024-05-01')
+    parser.add_argument('--changed-to', help='частичная перезагрузка: updated_at (created_at в таблицах связей) раньше этого')
+    parser.add_argument('--by-film', action='store_true',
+                        help='в таблицах связей применять отбор к фильму, на который ссылается строка')
+    parser.add_argument('--writer', choices=(WRITER_COPY, WRITER_INSERT), default=WRITER_COPY,
+                        help='способ записи в Postgres')
+    parser.add_argument('--parallel', action='store_true',
+                        help='грузить независимые таблицы параллельно на отдельных соединениях')
+    parser.add_argument('--partitions', type=int,
+                        help='разовый массовый перенос: каждая таблица делится на столько диапазонов id '
+                             'и пишется через асинхронные соединения')
+    parser.add_argument('--connections', type=int, default=CONNECTIONS,
+                        help='число асинхронных соединений с Postgres для --partitions')
+    parser.add_argument('--resume', action='store_true',
+                        help='фиксировать каждую пачку и продолжать загрузку с последней отметки')
+    parser.add_argument('--incremental', action='store_true',
+                        help='переносить только строки, изменённые после прошлого прохода')
+    parser.add_argument('--pipelined', action='store_true',
+                        help='читать SQLite параллельно с записью в Postgres через ограниченную очередь')
+    parser.add_argument('--batch-sizes', type=parse_batch_sizes, default={},
+                        help='закреплённые размеры пачек, например film_work=500,person_film_work=20000')
+    parser.add_argument('--memory-limit-mb', type=int, default=64,
+                        help='бюджет памяти на пачку таблицы в мегабайтах')
+    parser.add_argument('--report', default='load_report.json',
+                        help='файл итогового JSON-отчёта о переносе')
+    parser.add_argument('--prometheus',
+                        help='файл метрик для textfile-коллектора Prometheus')
+    parser.add_argument('--no-trace-memory', action='store_true',
+                        help='не отслеживать пик памяти через tracemalloc, он замедляет перенос')
+    parser.add_argument('--quarantine', action='store_true',
+                        help='строки с ошибками данных откладывать в etl.quarantine, остальные строки пачки записывать; каждая пачка фиксируется отдельно')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='ничего не загружать, а оценить время, объём WAL и размеры таблиц по пробной записи')
+    parser.add_argument('--dry-run-report', default='dry_run_report.json',
+                        help='файл JSON-отчёта оценки для --dry-run')
+    parser.add_argument('--preflight', action='store_true',
+                        help='до записи проверить связи на отсутствующих родителей и повторы ключей, при ошибках не загружать')
+    parser.add_argument('--bulk', action='store_true',
+                        help='снять вторичные индексы и внешние ключи на время загрузки и восстановить после')
+    parser.add_argument('--restore-deferred', action='store_true',
+                        help='только восстановить индексы и ключи, оставшиеся снятыми после сбоя')
+    parser.add_argument('--reset-checkpoints', action='store_true',
+                        help='сбросить отметки и отметки изменений и начать загрузку с начала')
+    args = parser.parse_args()
+    if args.partitions and (args.resume or args.incremental or args.parallel or args.quarantine):
+        parser.error('--partitions не совмещается с --resume, --incremental, --parallel и --quarantine')
+    if args.dry_run and (args.reset_checkpoints or args.bulk or args.restore_deferred):
+        parser.error('--dry-run не совмещается с --reset-checkpoints, --bulk и --restore-deferred')
+    partial = any((args.id_from, args.id_to, args.ids_file, args.changed_from, args.changed_to))
+    if partial and (args.resume or args.incremental or args.partitions):
+        parser.error('частичная перезагрузка не совмещается с --resume, --incremental и --partitions')
+    if args.by_film and set(args.tables) - set(film_tables):
+        parser.error(f'--by-film отбирает строки только таблиц {", ".join(film_tables)}, укажите их в --tables')
+    if args.partitions and len(args.sqlite) > 1:
+        parser.error('--partitions работает только с одним файлом SQLite')
+    return args
+
 
 if __name__ == '__main__':
-    dsl = {
-        'dbname': os.getenv('DB_NAME'),
-        'user': os.getenv('DB_USER'),
-        'password': os.getenv('DB_PASSWORD'),
-        'host': os.getenv('DB_HOST'),
-        'port': os.getenv('DB_PORT'),
-    }
+    args = parse_args()
+    dsl = dsl_from_env()
+
+    options = LoadOptions(
+        writer=args.writer,
+        resumable=args.resume,
+        incremental=args.incremental,
+        batch_sizes=args.batch_sizes,
+        memory_limit=args.memory_limit_mb * 1024 * 1024,
+        pipelined=args.pipelined,
+        metrics=RunMetrics(trace_memory=not args.no_trace_memory),
+        quarantine=args.quarantine,
+        row_filter=build_row_filter(args),
+    )
+    tables = {x: y for x, y in tables_for_load.items() if x in args.tables}
+    options.metrics.start()
+    status = 'failed'
 
     try:
-        with closing(sqlite3.connect('db.sqlite')) as sqlite_conn, closing(psycopg.connect(
-            **dsl, row_factory=dict_row, cursor_factory=ClientCursor
-        )) as pg_conn:
-            load_from_sqlite(sqlite_conn, pg_conn, tables_for_load)
-            pg_conn.commit()
+        if args.reset_checkpoints:
+            with closing(connect_postgres(dsl)) as pg_conn:
+                CheckpointStore.create_tables(pg_conn)
+                CheckpointStore(pg_conn).reset(tables)
+        if args.preflight and not all(x.ok for x in validate_links(args.sqlite, tables)):
+            logger.error('Проверка связей не пройдена, загрузка не начата')
+            sys.exit(1)
+        if args.dry_run:
+            with ExitStack() as stack:
+                sqlite_conns = [stack.enter_context(closing(connect_sqlite(x))) for x in args.sqlite]
+                pg_conn = stack.enter_context(closing(connect_postgres(dsl)))
+                write_report(estimate(sqlite_conns, pg_conn, tables, options), args.dry_run_report)
+            logger.info('Оценка переноса записана в %s', args.dry_run_report)
+        elif args.restore_deferred:
+            restore_deferred(dsl)
+        else:
+            with bulk_load_mode(dsl, tables) if args.bulk else nullcontext():
+                if args.partitions:
+                    asyncio.run(load_from_sqlite_async(args.sqlite[0], dsl, tables, options, args.partitions, args.connections))
+                elif args.parallel:
+                    load_from_sqlite_parallel(args.sqlite, dsl, tables, options)
+                else:
+                    with ExitStack() as stack:
+                        sqlite_conns = [stack.enter_context(closing(connect_sqlite(x))) for x in args.sqlite]
+                        pg_conn = stack.enter_context(closing(connect_postgres(dsl)))
+                        load_from_sqlite(sqlite_conns, pg_conn, tables, options)
+                        pg_conn.commit()
             logger.info('🎉 Данные успешно перенесены !!!')
+        status = 'success'
     except PermissionError as e:
         logger.error('Ошибка доступа: %s', e)
     except sqlite3.Error as e:
@@ -49,3 +190,9 @@ if __name__ == '__main__':
         logger.error('Ошибка подключения к Postgres: %s', e)
     except Exception as e: # Для перехвата всех необработанных исключений
         logger.error('Неизвестная ошибка: %s', e)
+    finally:
+        options.metrics.stop(status)
+        options.metrics.write_json(args.report)
+        if args.prometheus:
+            options.metrics.write_prometheus(args.prometheus)
+        logger.info('Отчёт о переносе записан в %s', args.report)
@@ -0,0 +1,164 @@
+import json
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from threading import Lock
+from typing import Iterator, Optional
+
+STAGES = ('extract', 'transform', 'load')
+# Границы корзин гистограммы длительности стадии на пачку, в секундах
+HISTOGRAM_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+@dataclass
+class Histogram:
+    counts: list[int] = field(default_factory=lambda: [0] * (len(HISTOGRAM_BUCKETS) + 1))
+    total: float = 0.0
+    count: int = 0
+
+    def observe(self, value: float):
+        for position, bound in enumerate(HISTOGRAM_BUCKETS):
+            if value <= bound:
+                break
+        else:
+            position = len(HISTOGRAM_BUCKETS)
+        self.counts[position] += 1
+        self.total += value
+        self.count += 1
+
+    def cumulative(self) -> list[tuple[str, int]]:
+        """Накопленные счётчики по верхним границам, как в Prometheus"""
+        result, running = [], 0
+        for bound, count in zip((*HISTOGRAM_BUCKETS, '+Inf'), self.counts):
+            running += count
+            result.append((str(bound), running))
+        return result
+
+
+@dataclass
+class TableMetrics:
+    rows: int = 0
+    bytes: int = 0
+    batches: int = 0
+    retries: int = 0
+    quarantined: int = 0
+    stages: dict[str, Histogram] = field(default_factory=lambda: {x: Histogram() for x in STAGES})
+
+
+class RunMetrics:
+    """Счётчики и гистограммы стадий переноса по таблицам, общие для всех потоков загрузки"""
+
+    def __init__(self, trace_memory: bool = True):
+        self.tables: dict[str, TableMetrics] = {}
+        self._lock = Lock()
+        self._trace_memory = trace_memory
+        self._started = time.time()
+        self._finished: Optional[float] = None
+        self._peak_memory: Optional[int] = None
+        self.status = 'running'
+
+    def start(self):
+        self._started = time.time()
+        if self._trace_memory:
+            tracemalloc.start()
+
+    def stop(self, status: str):
+        self.status = status
+        self._finished = time.time()
+        if self._trace_memory and tracemalloc.is_tracing():
+            self._peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+    def _table(self, table_name: str) -> TableMetrics:
+        if table_name not in self.tables:
+            self.tables[table_name] = TableMetrics()
+        return self.tables[table_name]
+
+    def observe(self, table_name: str, stage: str, seconds: float):
+        with self._lock:
+            self._table(table_name).stages[stage].observe(seconds)
+
+    @contextmanager
+    def timed(self, table_name: str, stage: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(table_name, stage, time.perf_counter() - started)
+
+    def record_batch(self, table_name: str, rows: int, nbytes: int):
+        with self._lock:
+            table = self._table(table_name)
+            table.rows += rows
+            table.bytes += nbytes
+            table.batches += 1
+
+    def count_retry(self, table_name: str):
+        with self._lock:
+            self._table(table_name).retries += 1
+
+    def count_quarantined(self, table_name: str):
+        with self._lock:
+            self._table(table_name).quarantined += 1
+
+    def report(self) -> dict:
+        with self._lock:
+            return {
+                'status': self.status,
+                'started': self._started,
+                'seconds': round((self._finished or time.time()) - self._started, 3),
+                'peak_memory_bytes': self._peak_memory,
+                'tables': {
+                    table_name: {
+                        'rows': table.rows,
+                        'bytes': table.bytes,
+                        'batches': table.batches,
+                        'retries': table.retries,
+                        'quarantined': table.quarantined,
+                        'stages': {
+                            stage: {
+                                'count': histogram.count,
+                                'seconds': round(histogram.total, 6),
+                                'buckets': dict(histogram.cumulative()),
+                            }
+                            for stage, histogram in table.stages.items()
+                        },
+                    }
+                    for table_name, table in self.tables.items()
+                },
+            }
+
+    def write_json(self, path: str):
+        with open(path, 'w') as report_file:
+            json.dump(self.report(), report_file, ensure_ascii=False, indent=2)
+
+    def write_prometheus(self, path: str):
+        """Файл для textfile-коллектора node_exporter, пишется через переименование целиком"""
+        report = self.report()
+        lines = [
+            '# HELP etl_run_seconds Длительность переноса',
+            '# TYPE etl_run_seconds gauge',
+            f'etl_run_seconds{{status="{report["status"]}"}} {report["seconds"]}',
+        ]
+        if report['peak_memory_bytes'] is not None:
+            lines += [
+                '# HELP etl_peak_memory_bytes Пик памяти Python по tracemalloc',
+                '# TYPE etl_peak_memory_bytes gauge',
+                f'etl_peak_memory_bytes {report["peak_memory_bytes"]}',
+            ]
+        for counter in ('rows', 'bytes', 'batches', 'retries', 'quarantined'):
+            lines += [f'# HELP etl_{counter}_total Перенесено по таблице: {counter}', f'# TYPE etl_{counter}_total counter']
+            lines += [f'etl_{counter}_total{{table="{x}"}} {y[counter]}' for x, y in report['tables'].items()]
+        lines += ['# HELP etl_stage_seconds Длительность стадии на пачку', '# TYPE etl_stage_seconds histogram']
+        for table_name, table in report['tables'].items():
+            for stage, histogram in table['stages'].items():
+                labels = f'table="{table_name}",stage="{stage}"'
+                lines += [f'etl_stage_seconds_bucket{{{labels},le="{x}"}} {y}' for x, y in histogram['buckets'].items()]
+                lines.append(f'etl_stage_seconds_sum{{{labels}}} {histogram["seconds"]}')
+                lines.append(f'etl_stage_seconds_count{{{labels}}} {histogram["count"]}')
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as metrics_file:
+            metrics_file.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, path)
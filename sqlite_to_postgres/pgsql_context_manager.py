@@ -1,42 +1,263 @@
-from psycopg import connection as pg_connection
+from psycopg import AsyncConnection, Pipeline, connection as pg_connection
 from psycopg.rows import dict_row
 from psycopg import errors as pg_errors
-from typing import Any, Tuple
-from contextlib import closing
-from dataclasses import dataclass, astuple, fields
+from typing import ContextManager, Iterator, Optional
+from contextlib import closing, contextmanager, nullcontext
+from functools import lru_cache
+from collections import Counter
+from dataclasses import dataclass, fields
+from datetime import datetime, date
+from uuid import UUID
+from row_converters import column_names
+from metrics import RunMetrics
+import json
 import logging
 
+# Способы записи пачки в Postgres
+WRITER_INSERT = 'insert'
+WRITER_COPY = 'copy'
 
-class PostgresSaver:
+# Соответствие типов полей датаклассов типам Postgres, нужно для бинарного COPY
+PG_TYPES = {
+    UUID: 'uuid',
+    str: 'text',
+    float: 'float8',
+    date: 'date',
+    datetime: 'timestamptz',
+}
+
+
+@lru_cache(maxsize=None)
+def pg_types(row_class: dataclass) -> list[str]:
+    return [PG_TYPES[x.type] for x in fields(row_class)]
+
+
+def on_conflict(columns: tuple[str, ...], upsert: bool) -> str:
+    if not upsert:
+        return 'ON CONFLICT (id) DO NOTHING'
+    updates = ', '.join(f'{x} = EXCLUDED.{x}' for x in columns if x != 'id')
+    return f'ON CONFLICT (id) DO UPDATE SET {updates}'
+
+
+@lru_cache(maxsize=None)
+def build_queries(table_name: str, row_class: dataclass, upsert: bool, schema: str = 'content') -> dict[str, str]:
+    """Тексты запросов записи, строятся один раз на таблицу"""
+    columns = column_names(row_class)
+    column_list = ', '.join(columns)
+    tmp_list = ', '.join(['%s'] * len(columns))
+    staging_table = f'staging_{table_name}'
+    return {
+        'insert': f'INSERT INTO {schema}.{table_name} ({column_list}) VALUES ({tmp_list}) {on_conflict(columns, upsert)}',
+        # Временная таблица не пишется в WAL и видна только текущему соединению,
+        # поэтому параллельные загрузчики не мешают друг другу
+        'create_staging': f'CREATE TEMP TABLE IF NOT EXISTS {staging_table} (LIKE {schema}.{table_name} INCLUDING DEFAULTS)',
+        'copy': f'COPY {staging_table} ({column_list}) FROM STDIN (FORMAT BINARY)',
+        'merge': f'INSERT INTO {schema}.{table_name} ({column_list}) SELECT {column_list} FROM {staging_table} {on_conflict(columns, upsert)}',
+        'truncate_staging': f'TRUNCATE {staging_table}',
+    }
+
+
+@contextmanager
+def pg_errors_logged(table_name: str) -> Iterator[None]:
+    """Логирование ошибок Postgres с последующим пробросом исключения"""
+    try:
+        yield
+    except pg_errors.OperationalError as e:
+        logging.error('Ошибка выполнения операции: %s', e)
+        raise
+    except pg_errors.ProgrammingError as e:
+        logging.error('Ошибка в SQL-запросе: %s', e)
+        raise
+    except pg_errors.IntegrityError as e:
+        logging.error('Нарушение целостности данных: %s', e)
+        raise
+    except pg_errors.DataError as e:
+        logging.error('Ошибка данных: %s', e)
+        raise
+    except pg_errors.InternalError as e:
+        logging.error('Внутренняя ошибка PostgreSQL: %s', e)
+        raise
+    except pg_errors.Error as e:
+        logging.error('Ошибка записи в Postgres таблицу %s: %s', table_name, e)
+        raise
+
+
+class Quarantine:
+    """Строки, которые Postgres отказался принять, вместе с текстом ошибки
+
+    Запись идёт в той же транзакции, что и остальная пачка, поэтому при откате
+    пачки отложенные строки откатываются вместе с ней.
+    """
     _connection = None
 
     def __init__(self, connection: pg_connection):
         self._connection = connection
+        self.counts = Counter()
+
+    @staticmethod
+    def create_table(connection: pg_connection):
+        """Создание etl.quarantine, как и CheckpointStore.create_tables - один раз до запуска потоков"""
+        with pg_errors_logged('etl.quarantine'), closing(connection.cursor()) as _cursor:
+            _cursor.execute('CREATE SCHEMA IF NOT EXISTS etl')
+            _cursor.execute(
+                'CREATE TABLE IF NOT EXISTS etl.quarantine ('
+                'id bigserial PRIMARY KEY, '
+                'table_name TEXT NOT NULL, '
+                'row_id TEXT, '
+                'row_data jsonb NOT NULL, '
+                'error TEXT NOT NULL, '
+                'created timestamp with time zone NOT NULL DEFAULT now())'
+            )
+        connection.commit()
+
+    def add(self, table_name: str, row_class: dataclass, row: tuple, error: Exception):
+        row_data = json.dumps(dict(zip(column_names(row_class), row)), ensure_ascii=False, default=str)
+        with pg_errors_logged('etl.quarantine'), closing(self._connection.cursor()) as _cursor:
+            _cursor.execute(
+                'INSERT INTO etl.quarantine (table_name, row_id, row_data, error) VALUES (%s, %s, %s, %s)',
+                (table_name, str(row[0]), row_data, str(error).strip()),
+            )
+        self.counts[table_name] += 1
+        logging.warning('Таблица %s: строка %s отложена в etl.quarantine: %s', table_name, row[0], str(error).strip())
+
 
-    def save_data(self, batch: Tuple[Any, ...], table_name: str, row_class: dataclass):
-        columns = [x.name for x in fields(row_class)]
-        column_list = ', '.join(columns)
-        tmp_list = ', '.join(['%s'] * len(columns))
-        query = f'INSERT INTO content.{table_name} ({column_list}) VALUES ({tmp_list}) ON CONFLICT (id) DO NOTHING'
-        batch_as_tuples = [astuple(data_row) for data_row in batch]
+class PostgresSaver:
+    _connection = None
+
+    def __init__(self, connection: pg_connection, writer: str = WRITER_INSERT, upsert: bool = False, quarantine: Optional[Quarantine] = None, metrics: Optional[RunMetrics] = None, schema: str = 'content'):
+        if writer not in (WRITER_INSERT, WRITER_COPY):
+            raise ValueError(f'Неизвестный способ записи: {writer}')
+        self._connection = connection
+        self._writer = writer
+        # При upsert изменённые строки перезаписываются, иначе существующие пропускаются
+        self._upsert = upsert
+        # С карантином упавшая пачка делится пополам, пока не останутся только плохие строки
+        self._quarantine = quarantine
+        self._metrics = metrics
+        self._schema = schema
+
+    def pipeline(self) -> ContextManager:
+        """Режим конвейера psycopg: запросы отправляются, не дожидаясь ответов на предыдущие
+
+        COPY в режиме конвейера не поддерживается, он и так передаёт пачку одним потоком.
+        Ошибка в конвейере обрывает все отправленные запросы, поэтому с карантином он не включается.
+        """
+        if self._writer == WRITER_COPY or self._quarantine is not None:
+            return nullcontext()
+        if not Pipeline.is_supported():
+            logging.warning('Режим конвейера не поддерживается libpq, запросы пойдут последовательно')
+            return nullcontext()
+        return self._connection.pipeline()
+
+    def save_data(self, batch: list[tuple], table_name: str, row_class: dataclass):
+        """Запись пачки кортежей, значения идут в порядке полей row_class"""
+        with pg_errors_logged(table_name):
+            if self._quarantine is not None:
+                self._save_isolated(batch, table_name, row_class)
+            else:
+                self._write(batch, table_name, row_class)
+
+    def _write(self, batch: list[tuple], table_name: str, row_class: dataclass):
+        if self._writer == WRITER_COPY:
+            self.copy_data(batch, table_name, row_class)
+        else:
+            self.insert_data(batch, table_name, row_class)
+
+    def commit(self):
+        self._connection.commit()
+
+    @contextmanager
+    def _savepoint(self) -> Iterator[None]:
+        """Точка сохранения внутри текущей транзакции, при ошибке откат только к ней"""
+        with closing(self._connection.cursor()) as _cursor:
+            _cursor.execute('SAVEPOINT save_batch')
+            try:
+                yield
+            except BaseException:
+                # После отката точка сохранения остаётся открытой, её нужно отпустить
+                _cursor.execute('ROLLBACK TO SAVEPOINT save_batch')
+                _cursor.execute('RELEASE SAVEPOINT save_batch')
+                raise
+            _cursor.execute('RELEASE SAVEPOINT save_batch')
+
+    def _save_isolated(self, batch: list[tuple], table_name: str, row_class: dataclass):
+        """Запись пачки с откладыванием строк с ошибками данных в карантин
+
+        С карантином load_table фиксирует каждую пачку, поэтому транзакция содержит
+        только её: чистая пачка пишется одним запросом без точки сохранения,
+        упавшая откатывается целиком и делится пополам. Каждая точка сохранения -
+        подтранзакция, и больше 64 подтранзакций с записью в одной транзакции
+        переполняют кэш subxid обслуживающего процесса.
+        """
         try:
-            with closing(self._connection.cursor(row_factory=dict_row)) as _cursor:
-                _cursor.executemany(query, batch_as_tuples)
-        except pg_errors.OperationalError as e:
-            logging.error('Ошибка выполнения операции: %s', e)
-            raise
-        except pg_errors.ProgrammingError as e:
-            logging.error('Ошибка в SQL-запросе: %s', e)
-            raise
-        except pg_errors.IntegrityError as e:
-            logging.error('Нарушение целостности данных: %s', e)
-            raise
-        except pg_errors.DataError as e:
-            logging.error('Ошибка данных: %s', e)
-            raise
-        except pg_errors.InternalError as e:
-            logging.error('Внутренняя ошибка PostgreSQL: %s', e)
-            raise
-        except pg_errors.Error as e:
-            logging.error('Ошибка записи в Postgres таблицу %s: %s', table_name, e)
-            raise
+            self._write(batch, table_name, row_class)
+            return
+        except (pg_errors.DataError, pg_errors.IntegrityError) as e:
+            self._connection.rollback()
+            error = e
+        self._bisect(batch, table_name, row_class, error)
+
+    def _bisect(self, batch: list[tuple], table_name: str, row_class: dataclass, error: Exception):
+        """Деление упавшей пачки пополам до отдельных плохих строк, каждая половина пишется в своей точке сохранения
+
+        На каждую плохую строку приходится порядка 2*log2(размер пачки) повторов всё меньшего размера.
+        """
+        if len(batch) == 1:
+            self._quarantine.add(table_name, row_class, batch[0], error)
+            if self._metrics:
+                self._metrics.count_quarantined(table_name)
+            return
+        if self._metrics:
+            self._metrics.count_retry(table_name)
+        middle = len(batch) // 2
+        for part in (batch[:middle], batch[middle:]):
+            try:
+                with self._savepoint():
+                    self._write(part, table_name, row_class)
+            except (pg_errors.DataError, pg_errors.IntegrityError) as e:
+                self._bisect(part, table_name, row_class, e)
+
+    def insert_data(self, batch: list[tuple], table_name: str, row_class: dataclass):
+        """Построчная вставка пачки через executemany"""
+        queries = build_queries(table_name, row_class, self._upsert, self._schema)
+        with closing(self._connection.cursor(row_factory=dict_row)) as _cursor:
+            _cursor.executemany(queries['insert'], batch)
+
+    def copy_data(self, batch: list[tuple], table_name: str, row_class: dataclass):
+        """Бинарный COPY пачки в промежуточную таблицу и одна вставка из неё в целевую"""
+        queries = build_queries(table_name, row_class, self._upsert, self._schema)
+        with closing(self._connection.cursor()) as _cursor:
+            _cursor.execute(queries['create_staging'])
+            with _cursor.copy(queries['copy']) as copy:
+                copy.set_types(pg_types(row_class))
+                for data_row in batch:
+                    copy.write_row(data_row)
+            _cursor.execute(queries['merge'])
+            _cursor.execute(queries['truncate_staging'])
+
+
+class AsyncPostgresSaver:
+    """Асинхронный вариант PostgresSaver поверх psycopg.AsyncConnection"""
+    _connection = None
+
+    def __init__(self, connection: AsyncConnection, writer: str = WRITER_INSERT, upsert: bool = False):
+        if writer not in (WRITER_INSERT, WRITER_COPY):
+            raise ValueError(f'Неизвестный способ записи: {writer}')
+        self._connection = connection
+        self._writer = writer
+        self._upsert = upsert
+
+    async def save_data(self, batch: list[tuple], table_name: str, row_class: dataclass):
+        queries = build_queries(table_name, row_class, self._upsert)
+        with pg_errors_logged(table_name):
+            async with self._connection.cursor() as _cursor:
+                if self._writer == WRITER_INSERT:
+                    await _cursor.executemany(queries['insert'], batch)
+                    return
+                await _cursor.execute(queries['create_staging'])
+                async with _cursor.copy(queries['copy']) as copy:
+                    copy.set_types(pg_types(row_class))
+                    for data_row in batch:
+                        await copy.write_row(data_row)
+                await _cursor.execute(queries['merge'])
+                await _cursor.execute(queries['truncate_staging'])
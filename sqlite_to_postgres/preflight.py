@@ -0,0 +1,274 @@
+import logging
+import sqlite3
+import sys
+from array import array
+from bisect import bisect_left
+from contextlib import ExitStack, closing
+from dataclasses import dataclass, field
+from heapq import merge
+from itertools import groupby
+from operator import itemgetter
+from typing import Iterable, Optional, Union
+
+from db_data_classes import GenreFilmWork, PersonFilmWork
+from row_converters import column_names, parse_datetime
+from sqlite_context_manger import connect_sqlite, source_columns
+
+# Датаклассы таблиц связей, родительские таблицы по столбцам и ключи уникальных индексов из ddl_content.sql
+LINK_TABLES = {
+    'genre_film_work': {
+        'row_class': GenreFilmWork,
+        'parents': {'film_work_id': 'film_work', 'genre_id': 'genre'},
+        'unique': ('film_work_id', 'genre_id'),
+    },
+    'person_film_work': {
+        'row_class': PersonFilmWork,
+        'parents': {'film_work_id': 'film_work', 'person_id': 'person'},
+        'unique': ('film_work_id', 'person_id', 'role'),
+    },
+}
+# Больше стольких id родителя упакованный массив заменяется фильтром Блума
+SET_LIMIT = 10_000_000
+# Около 1% ложных попаданий при 10 битах и 7 хэшах на id
+BLOOM_BITS_PER_ID = 10
+BLOOM_HASHES = 7
+FETCH_SIZE = 10_000
+# Сколько примеров каждой проблемы попадает в отчёт
+SAMPLES = 10
+
+
+HALF_MASK = (1 << 64) - 1
+
+
+def id_key(value: str) -> Optional[int]:
+    """uuid из текста SQLite как 128-битное число без создания объекта UUID, None - если это не uuid"""
+    digits = value.replace('-', '') if isinstance(value, str) else ''
+    if len(digits) != 32:
+        return None
+    try:
+        return int(digits, 16)
+    except ValueError:
+        return None
+
+
+class PackedIds:
+    """Отсортированные id по 16 байт: старшие и младшие 8 байт в двух массивах array('Q')
+
+    Поиск - бинарный по старшей половине. id добавляются по возрастанию,
+    повторы пропускаются; если порядок нарушен, массивы сортируются в finish().
+    """
+
+    def __init__(self):
+        self._high, self._low = array('Q'), array('Q')
+        self._last = -1
+        self._sorted = True
+
+    def add(self, key: int):
+        if key == self._last:
+            return
+        if key < self._last:
+            self._sorted = False
+        self._high.append(key >> 64)
+        self._low.append(key & HALF_MASK)
+        self._last = key
+
+    def finish(self) -> 'PackedIds':
+        if not self._sorted:
+            pairs = sorted(set(zip(self._high, self._low)))
+            self._high = array('Q', (x for x, _ in pairs))
+            self._low = array('Q', (x for _, x in pairs))
+            self._sorted = True
+        return self
+
+    def __len__(self) -> int:
+        return len(self._high)
+
+    def __contains__(self, key: int) -> bool:
+        high, low = key >> 64, key & HALF_MASK
+        position = bisect_left(self._high, high)
+        while position < len(self._high) and self._high[position] == high:
+            if self._low[position] == low:
+                return True
+            position += 1
+        return False
+
+
+class BloomFilter:
+    """Фильтр Блума по битовому массиву: ложные попадания возможны, пропуски - нет"""
+
+    def __init__(self, capacity: int):
+        self._size = max(capacity * BLOOM_BITS_PER_ID, 8)
+        self._bits = bytearray((self._size + 7) // 8)
+
+    def _positions(self, key: int) -> Iterable[int]:
+        first, second = hash(key), hash(key >> 64) | 1
+        return ((first + x * second) % self._size for x in range(BLOOM_HASHES))
+
+    def add(self, key: int):
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key: int) -> bool:
+        return all(self._bits[x >> 3] & (1 << (x & 7)) for x in self._positions(key))
+
+
+@dataclass
+class LinkReport:
+    table_name: str
+    rows: int = 0
+    # Число строк со ссылкой в никуда по столбцам
+    orphans: dict[str, int] = field(default_factory=dict)
+    orphan_samples: list[tuple[str, str, str]] = field(default_factory=list)
+    # Число строк, где ссылка - не uuid
+    malformed: int = 0
+    malformed_samples: list[tuple[str, str, str]] = field(default_factory=list)
+    # Число лишних строк с повторяющимся ключом уникального индекса
+    duplicates: int = 0
+    duplicate_samples: list[tuple] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return not (any(self.orphans.values()) or self.malformed or self.duplicates)
+
+
+def _sorted_ids(connection: sqlite3.Connection, table_name: str) -> Iterable[str]:
+    with closing(connection.cursor()) as _cursor:
+        _cursor.arraysize = FETCH_SIZE
+        # Текстовое представление, чтобы слияние файлов не сравнивало строки с числами
+        _cursor.execute(f'SELECT CAST(id AS TEXT) FROM {table_name} WHERE id IS NOT NULL ORDER BY 1')
+        while rows := _cursor.fetchmany():
+            for (value,) in rows:
+                yield value
+
+
+def parent_ids(connections: list[sqlite3.Connection], table_name: str) -> Union[PackedIds, BloomFilter]:
+    """id родительской таблицы из всех источников: упакованный массив или фильтр Блума для очень больших таблиц
+
+    id читаются по возрастанию и сливаются, поэтому массив собирается уже отсортированным.
+    Строки с id не в формате uuid пропускаются с предупреждением.
+    """
+    total = sum(x.execute(f'SELECT count(*) FROM {table_name}').fetchone()[0] for x in connections)
+    ids = PackedIds() if total <= SET_LIMIT else BloomFilter(total)
+    if isinstance(ids, BloomFilter):
+        logging.info('Таблица %s: %s id, проверка по фильтру Блума может пропустить до 1%% сирот', table_name, total)
+    malformed = []
+    with ExitStack() as stack:
+        streams = [stack.enter_context(closing(_sorted_ids(x, table_name))) for x in connections]
+        for value in merge(*streams):
+            key = id_key(value)
+            if key is None:
+                malformed.append(value)
+                continue
+            ids.add(key)
+    if malformed:
+        logging.warning('Таблица %s: %s id не в формате uuid, например %s', table_name, len(malformed), malformed[:SAMPLES])
+    return ids.finish() if isinstance(ids, PackedIds) else ids
+
+
+def _sorted_rows(connection: sqlite3.Connection, table_name: str, columns: list[str], order_by: int, where: str, source: int) -> Iterable[tuple]:
+    """Строки по возрастанию первых order_by столбцов, последним значением - номер файла source"""
+    with closing(connection.cursor()) as _cursor:
+        _cursor.arraysize = FETCH_SIZE
+        order = ', '.join(str(x + 1) for x in range(order_by))
+        _cursor.execute(f'SELECT {", ".join(columns)} FROM {table_name} WHERE {where} ORDER BY {order}')
+        while rows := _cursor.fetchmany():
+            for row in rows:
+                yield (*row, source)
+
+
+def _version(created: Optional[str]) -> tuple:
+    """Ключ выбора строки из повторов id, как в MergedSQLiteLoader: строка без времени проигрывает любой датированной"""
+    return (created is not None, parse_datetime(created) if created is not None else 0)
+
+
+def check_links(connections: list[sqlite3.Connection], table_name: str, parents: dict[str, Union[PackedIds, BloomFilter]]) -> LinkReport:
+    """Проверка строк таблицы связей в том виде, в каком их запишет MergedSQLiteLoader
+
+    Из строк с одним id во всех файлах проверяется только победившая: самая поздняя
+    по created, при равенстве - из файла, указанного раньше. Повторы ключа ищутся
+    слиянием отсортированных по ключу строк всех файлов без проигравших строк.
+    """
+    spec = LINK_TABLES[table_name]
+    columns = list(spec['parents'])
+    report = LinkReport(table_name, orphans={x: 0 for x in columns})
+    checks = [(position + 1, column, parents[spec['parents'][column]]) for position, column in enumerate(columns)]
+    # Номера файлов и id строк, которые заменит строка с тем же id из другого файла
+    losers = set()
+    with ExitStack() as stack:
+        streams = []
+        for source, connection in enumerate(connections):
+            created = source_columns(connection, table_name, spec['row_class'])[column_names(spec['row_class']).index('created')]
+            streams.append(stack.enter_context(closing(_sorted_rows(
+                connection, table_name, ['CAST(id AS TEXT)', *columns, created], 1, 'id IS NOT NULL', source,
+            ))))
+        for _, rows in groupby(merge(*streams, key=itemgetter(0)), key=itemgetter(0)):
+            rows = list(rows)
+            # merge устойчиво, max берёт первую из равных - строку из файла, указанного раньше
+            row = max(rows, key=lambda x: _version(x[-2]))
+            losers.update((x[-1], x[0]) for x in rows if x is not row)
+            report.rows += 1
+            for position, column, ids in checks:
+                key = id_key(row[position]) if row[position] is not None else None
+                if key is None and row[position] is not None:
+                    report.malformed += 1
+                    if len(report.malformed_samples) < SAMPLES:
+                        report.malformed_samples.append((row[0], column, row[position]))
+                elif key is None or key not in ids:
+                    report.orphans[column] += 1
+                    if len(report.orphan_samples) < SAMPLES:
+                        report.orphan_samples.append((row[0], column, row[position]))
+
+    # Ключи сортирует сам SQLite, держать в памяти все ключи связей слишком дорого
+    key_columns = spec['unique']
+    where = ' AND '.join(f'{x} IS NOT NULL' for x in ('id', *key_columns))
+    key_of = itemgetter(*range(len(key_columns)))
+    with ExitStack() as stack:
+        streams = [
+            stack.enter_context(closing(_sorted_rows(
+                connection, table_name, [*(f'CAST({x} AS TEXT)' for x in key_columns), 'CAST(id AS TEXT)'],
+                len(key_columns) + 1, where, source,
+            )))
+            for source, connection in enumerate(connections)
+        ]
+        for key, rows in groupby(merge(*streams, key=key_of), key=key_of):
+            count = sum(1 for x in rows if (x[-1], x[-2]) not in losers)
+            if count > 1:
+                report.duplicates += count - 1
+                if len(report.duplicate_samples) < SAMPLES:
+                    report.duplicate_samples.append((*key, count))
+    return report
+
+
+def validate_links(sqlite_paths: list[str], tables: Iterable[str] = LINK_TABLES) -> list[LinkReport]:
+    """Проверка таблиц связей до загрузки: ссылки на отсутствующих родителей и повторы уникальных ключей
+
+    Родители собираются из всех файлов, поэтому связь из одного файла может ссылаться
+    на фильм из другого. Связи проверяются после слияния файлов, как их запишет загрузка.
+    """
+    tables = [x for x in tables if x in LINK_TABLES]
+    with ExitStack() as stack:
+        connections = [stack.enter_context(closing(connect_sqlite(x))) for x in sqlite_paths]
+        parent_tables = {y for x in tables for y in LINK_TABLES[x]['parents'].values()}
+        parents = {x: parent_ids(connections, x) for x in sorted(parent_tables)}
+        reports = [check_links(connections, x, parents) for x in tables]
+    for report in reports:
+        if report.ok:
+            logging.info('Таблица %s: %s строк, ошибок связей нет', report.table_name, report.rows)
+            continue
+        logging.error(
+            'Таблица %s: %s строк, без родителя %s, ссылок не в формате uuid %s, повторов ключа %s',
+            report.table_name, report.rows, report.orphans, report.malformed, report.duplicates,
+        )
+        for row_id, column, value in report.orphan_samples:
+            logging.error('  %s %s: %s = %s не найден', report.table_name, row_id, column, value)
+        for row_id, column, value in report.malformed_samples:
+            logging.error('  %s %s: %s = %r не uuid', report.table_name, row_id, column, value)
+        for row in report.duplicate_samples:
+            logging.error('  %s: ключ %s встречается %s раз', report.table_name, row[:-1], row[-1])
+    return reports
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+    reports = validate_links(sys.argv[1:] or ['db.sqlite'])
+    sys.exit(0 if all(x.ok for x in reports) else 1)
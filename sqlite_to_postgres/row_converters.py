@@ -0,0 +1,44 @@
+from uuid import UUID
+from datetime import datetime, date, timezone
+from dataclasses import dataclass, fields
+from functools import lru_cache
+from typing import Callable
+
+# Разбор строковых значений SQLite по типу поля датакласса
+PARSERS = {
+    UUID: 'UUID',
+    datetime: 'parse_datetime',
+    date: 'date.fromisoformat',
+}
+
+
+def parse_datetime(value: str) -> datetime:
+    """Время из SQLite; значение без смещения считается UTC
+
+    Столбцы Postgres - timestamptz, а бинарный COPY принимает только время с часовым поясом.
+    """
+    moment = datetime.fromisoformat(value)
+    return moment if moment.tzinfo is not None else moment.replace(tzinfo=timezone.utc)
+
+
+@lru_cache(maxsize=None)
+def column_names(row_class: dataclass) -> tuple[str, ...]:
+    return tuple(x.name for x in fields(row_class))
+
+
+@lru_cache(maxsize=None)
+def get_converter(row_class: dataclass) -> Callable[[tuple], tuple]:
+    """Функция преобразования строки SQLite в кортеж значений для Postgres
+
+    Датакласс служит только описанием схемы: по типам его полей один раз собирается
+    функция без проверок isinstance и создания объектов на каждую строку.
+    """
+    items = []
+    for position, field in enumerate(fields(row_class)):
+        value = f'row[{position}]'
+        parser = PARSERS.get(field.type)
+        items.append(f'({parser}({value}) if {value}.__class__ is str else {value})' if parser else value)
+    source = f'def convert(row):\n    return ({", ".join(items)},)\n'
+    namespace = {'UUID': UUID, 'parse_datetime': parse_datetime, 'date': date}
+    exec(compile(source, f'<converter {row_class.__name__}>', 'exec'), namespace)
+    return namespace['convert']
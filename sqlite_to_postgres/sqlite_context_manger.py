@@ -1,22 +1,154 @@
+import asyncio
+import os
 import sqlite3
-from typing import Generator, Union
-from dataclasses import dataclass
+from typing import AsyncGenerator, Generator, Optional
+from urllib.parse import quote
+from dataclasses import dataclass, fields
 from contextlib import closing
-from db_data_classes import FilmWork, Person, Genre, GenreFilmWork, PersonFilmWork
+from collections import deque
+from heapq import merge
+from itertools import groupby
+from operator import itemgetter
+from queue import Full, Queue
+from threading import Event, Thread
+from concurrent.futures import Executor
+from row_converters import column_names, get_converter
+from batch_sizer import BatchSizer
+from metrics import RunMetrics
 import logging
+import time
+
+# Сколько пачек может одновременно находиться в пуле преобразования
+TRANSFORM_WINDOW = 4
+# Сколько готовых пачек может ждать записи при конвейерной загрузке
+PIPELINE_DEPTH = 4
+
+# Отображение файла источника в память и кэш страниц SQLite (в КиБ при отрицательном значении)
+MMAP_SIZE = 4 * 1024 ** 3
+CACHE_SIZE = -256 * 1024
+
+# Имена столбцов SQLite, отличающиеся от полей датаклассов
+SOURCE_COLUMNS = {'created': 'created_at', 'modified': 'updated_at'}
+
+_END_OF_DATA = object()
+
+
+def connect_sqlite(path: str) -> sqlite3.Connection:
+    """Открытие источника только для чтения
+
+    immutable=1 отключает блокировки и проверки изменения файла, страницы читаются
+    через mmap без копирования в кэш SQLite. Файл источника не должен меняться
+    во время переноса. Соединение можно передавать в потоки чтения.
+    """
+    uri = f'file:{quote(os.path.abspath(path))}?mode=ro&immutable=1'
+    connection = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    connection.execute(f'PRAGMA mmap_size = {MMAP_SIZE}')
+    connection.execute(f'PRAGMA cache_size = {CACHE_SIZE}')
+    return connection
+
+
+def source_columns(connection: sqlite3.Connection, table_name: str, row_class: dataclass) -> tuple[str, ...]:
+    """Столбцы таблицы SQLite в порядке полей датакласса по PRAGMA table_info"""
+    with closing(connection.cursor()) as _cursor:
+        _cursor.execute(f'PRAGMA table_info({table_name})')
+        available = {x[1] for x in _cursor.fetchall()}
+    columns = []
+    for field in fields(row_class):
+        column = field.name if field.name in available else SOURCE_COLUMNS.get(field.name)
+        if column not in available:
+            raise sqlite3.OperationalError(f'В таблице {table_name} нет столбца для поля {field.name}')
+        columns.append(column)
+    return tuple(columns)
+
+
+def build_rows(row_class: dataclass, batch: list[tuple]) -> list[tuple]:
+    """Преобразование пачки строк SQLite в кортежи по схеме датакласса, вынесено на уровень модуля для пула процессов"""
+    convert = get_converter(row_class)
+    return [convert(row_data) for row_data in batch]
+
+
+def timed_build_rows(row_class: dataclass, batch: list[tuple]) -> tuple[list[tuple], float]:
+    """build_rows с замером времени в том процессе пула, где идёт преобразование"""
+    started = time.perf_counter()
+    rows = build_rows(row_class, batch)
+    return rows, time.perf_counter() - started
+
+
+def read_ahead(batches: Generator[list[tuple], None, None], depth: int = PIPELINE_DEPTH) -> Generator[list[tuple], None, None]:
+    """Чтение и преобразование пачек в отдельном потоке, пока вызывающий пишет предыдущие
+
+    Очередь ограничена depth пачками: если запись отстаёт, поток чтения ждёт.
+    Ошибка чтения пробрасывается в вызывающий поток. Соединение SQLite должно быть
+    открыто с check_same_thread=False.
+    """
+    queue = Queue(maxsize=depth)
+    stopped = Event()
+
+    def put(item) -> bool:
+        while not stopped.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                continue
+        return False
+
+    def reader():
+        try:
+            for batch in batches:
+                if not put(batch):
+                    break
+            else:
+                put(_END_OF_DATA)
+        except BaseException as e:
+            put(e)
+        finally:
+            batches.close()
+
+    thread = Thread(target=reader, name='sqlite-reader', daemon=True)
+    thread.start()
+    try:
+        while (item := queue.get()) is not _END_OF_DATA:
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stopped.set()
+        thread.join()
 
 
 class SQLiteLoader:
     _connection = None
 
-    def __init__(self, connection: sqlite3.Connection, batch_size: int):
+    def __init__(self, connection: sqlite3.Connection, batch_size: int, executor: Optional[Executor] = None, metrics: Optional[RunMetrics] = None):
         self._connection = connection
         self._batch_size = batch_size
+        self._executor = executor
+        self._metrics = metrics
+
+    def extract_data(self, sqlite_cursor: sqlite3.Cursor, table_name: str, after_id: Optional[str] = None, where: str = '', params: tuple = (), batch_sizer: Optional[BatchSizer] = None, columns: Optional[tuple[str, ...]] = None) -> Generator[list[sqlite3.Row], None, None]:
+        """Постраничное чтение по ключу: каждая пачка - отдельный запрос WHERE id > последний id
 
-    def extract_data(self, sqlite_cursor: sqlite3.Cursor, table_name: str) -> Generator[list[sqlite3.Row], None, None]:
+        where - дополнительное условие отбора строк с параметрами params
+        batch_sizer - источник размера очередной пачки, иначе используется постоянный batch_size
+        columns - выбираемые столбцы, первым должен идти id
+        """
+        last_id = after_id or ''
+        condition = f' AND ({where})' if where else ''
+        column_list = ', '.join(columns) if columns else '*'
         try:
-            sqlite_cursor.execute(f'SELECT * FROM {table_name}')
-            while results := sqlite_cursor.fetchmany(self._batch_size):
+            while True:
+                started = time.perf_counter()
+                sqlite_cursor.execute(
+                    f'SELECT {column_list} FROM {table_name} WHERE id > ?{condition} ORDER BY id LIMIT ?',
+                    (last_id, *params, batch_sizer.size if batch_sizer else self._batch_size),
+                )
+                results = sqlite_cursor.fetchall()
+                if self._metrics:
+                    self._metrics.observe(table_name, 'extract', time.perf_counter() - started)
+                if not results:
+                    break
+                last_id = results[-1][0]
                 yield results
         except sqlite3.OperationalError as e:
             logging.error('Ошибка выполнения операции: %s', e)
@@ -28,7 +160,105 @@ class SQLiteLoader:
             logging.error('Ошибка чтения из SQLite таблицы %s: %s', table_name, e)
             raise
 
-    def transform_data(self, table_name: str, row_class: dataclass) -> Generator[list[Union[FilmWork, Person, Genre, GenreFilmWork, PersonFilmWork]], None, None]:
+    def max_value(self, table_name: str, column: str) -> Optional[str]:
         with closing(self._connection.cursor()) as _cursor:
-            for batch in self.extract_data(_cursor, table_name):
-                yield [row_class(*row_data) for row_data in batch]
+            try:
+                _cursor.execute(f'SELECT max({column}) FROM {table_name}')
+            except sqlite3.Error as e:
+                logging.error('Ошибка чтения из SQLite таблицы %s: %s', table_name, e)
+                raise
+            return _cursor.fetchone()[0]
+
+    def transform_data(self, table_name: str, row_class: dataclass, after_id: Optional[str] = None, where: str = '', params: tuple = (), batch_sizer: Optional[BatchSizer] = None) -> Generator[list[tuple], None, None]:
+        columns = source_columns(self._connection, table_name, row_class)
+        with closing(self._connection.cursor()) as _cursor:
+            if self._executor is None:
+                for batch in self.extract_data(_cursor, table_name, after_id, where, params, batch_sizer, columns):
+                    yield self._transformed(table_name, timed_build_rows(row_class, batch))
+                return
+            # Пачки преобразуются в пуле, пока читаются следующие; порядок пачек сохраняется
+            pending = deque()
+            for batch in self.extract_data(_cursor, table_name, after_id, where, params, batch_sizer, columns):
+                pending.append(self._executor.submit(timed_build_rows, row_class, batch))
+                if len(pending) >= TRANSFORM_WINDOW:
+                    yield self._transformed(table_name, pending.popleft().result())
+            while pending:
+                yield self._transformed(table_name, pending.popleft().result())
+
+    def _transformed(self, table_name: str, result: tuple[list[tuple], float]) -> list[tuple]:
+        rows, seconds = result
+        if self._metrics:
+            self._metrics.observe(table_name, 'transform', seconds)
+        return rows
+
+
+def _rows(batches: Generator[list[tuple], None, None]) -> Generator[tuple, None, None]:
+    try:
+        for batch in batches:
+            yield from batch
+    finally:
+        batches.close()
+
+
+class MergedSQLiteLoader:
+    """Чтение нескольких файлов SQLite как одного источника
+
+    Каждый файл читается в своём потоке по возрастанию id, потоки сливаются
+    слиянием отсортированных последовательностей. Из строк с одинаковым id
+    остаётся строка с самым поздним modified (в таблицах связей - created),
+    при равенстве - из файла, указанного раньше. На выходе те же пачки, что
+    у SQLiteLoader, упорядоченные по id, поэтому работают отметки и --resume.
+    """
+
+    def __init__(self, connections: list[sqlite3.Connection], batch_size: int, executor: Optional[Executor] = None, metrics: Optional[RunMetrics] = None):
+        self._loaders = [SQLiteLoader(x, batch_size, executor, metrics) for x in connections]
+        self._batch_size = batch_size
+
+    def max_value(self, table_name: str, column: str) -> Optional[str]:
+        values = [x for x in (loader.max_value(table_name, column) for loader in self._loaders) if x is not None]
+        return max(values, default=None)
+
+    @staticmethod
+    def _winner(row_class: dataclass):
+        names = column_names(row_class)
+        position = names.index('modified' if 'modified' in names else 'created')
+        # Строка без времени изменения проигрывает любой датированной
+        return lambda rows: max(rows, key=lambda x: (x[position] is not None, x[position] or 0))
+
+    def transform_data(self, table_name: str, row_class: dataclass, after_id: Optional[str] = None, where: str = '', params: tuple = (), batch_sizer: Optional[BatchSizer] = None) -> Generator[list[tuple], None, None]:
+        streams = [
+            _rows(read_ahead(x.transform_data(table_name, row_class, after_id, where, params, batch_sizer)))
+            for x in self._loaders
+        ]
+        winner = self._winner(row_class)
+        batch = []
+        try:
+            # merge устойчиво: строки одного id идут в порядке файлов, max берёт первую из равных
+            for _, rows in groupby(merge(*streams, key=itemgetter(0)), key=itemgetter(0)):
+                batch.append(winner(rows))
+                if len(batch) >= (batch_sizer.size if batch_sizer else self._batch_size):
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+        finally:
+            for stream in streams:
+                stream.close()
+
+
+class AsyncSQLiteLoader:
+    """Асинхронный вариант SQLiteLoader: пачки читаются в потоке, не блокируя цикл событий
+
+    Соединение должно быть открыто с check_same_thread=False.
+    """
+
+    def __init__(self, connection: sqlite3.Connection, batch_size: int, executor: Optional[Executor] = None, metrics: Optional[RunMetrics] = None):
+        self._loader = SQLiteLoader(connection, batch_size, executor, metrics)
+
+    async def transform_data(self, table_name: str, row_class: dataclass, after_id: Optional[str] = None, where: str = '', params: tuple = (), batch_sizer: Optional[BatchSizer] = None) -> AsyncGenerator[list[tuple], None]:
+        batches = self._loader.transform_data(table_name, row_class, after_id, where, params, batch_sizer)
+        try:
+            while (batch := await asyncio.to_thread(next, batches, None)) is not None:
+                yield batch
+        finally:
+            await asyncio.to_thread(batches.close)
@@ -0,0 +1,52 @@
+from batch_sizer import GROW_FACTOR, MIN_BATCH_SIZE, PROBE_BATCHES, BatchSizer, batch_bytes
+
+
+def feed(sizer: BatchSizer, seconds_per_row: float, bytes_per_row: int = 100):
+    """PROBE_BATCHES полных пачек текущего размера с заданной скоростью"""
+    for _ in range(PROBE_BATCHES):
+        sizer.record(sizer.size, sizer.size * bytes_per_row, sizer.size * seconds_per_row)
+
+
+# Пока скорость растёт, пачка удваивается
+def test_grows_while_rate_improves():
+    sizer = BatchSizer('person', 100)
+    feed(sizer, 0.001)
+    assert sizer.size == 100 * GROW_FACTOR
+    feed(sizer, 0.0005)
+    assert sizer.size == 100 * GROW_FACTOR ** 2
+
+
+# Без заметного роста скорости возвращается лучший размер и больше не меняется
+def test_settles_on_best_size():
+    sizer = BatchSizer('person', 100)
+    feed(sizer, 0.001)
+    feed(sizer, 0.001)
+    assert sizer.size == 100
+    feed(sizer, 0.0001)
+    assert sizer.size == 100
+
+
+# Размер пачки не выходит за бюджет памяти
+def test_memory_limit_caps_size():
+    sizer = BatchSizer('person', 100, memory_limit=100 * 1000)
+    feed(sizer, 0.001, bytes_per_row=1000)
+    assert sizer.size == 100
+    sizer = BatchSizer('person', 100, memory_limit=10)
+    feed(sizer, 0.001, bytes_per_row=1000)
+    assert sizer.size == MIN_BATCH_SIZE
+
+
+# Неполная последняя пачка и закреплённый размер скорость не меняют
+def test_partial_and_pinned_batches_keep_size():
+    sizer = BatchSizer('person', 100)
+    for _ in range(PROBE_BATCHES):
+        sizer.record(50, 5000, 0.05)
+    assert sizer.size == 100
+    pinned = BatchSizer('person', 100, adaptive=False)
+    feed(pinned, 0.001)
+    assert pinned.size == 100
+
+
+def test_batch_bytes():
+    assert batch_bytes([]) == 0
+    assert batch_bytes([('abcd', 1)] * 10) == (4 + 16) * 10
@@ -1,6 +1,5 @@
 import pytest
 import os
-import sqlite3
 #from contextlib import closing
 from dataclasses import dataclass, fields  #, astuple
 #from typing import Generator, Any, Union, Tuple
@@ -12,6 +11,9 @@ from psycopg import ClientCursor  #, connection as pg_connection
 from psycopg.rows import dict_row
 #from psycopg import errors as pg_errors
 
+from consistency_checker import ConsistencyChecker
+from sqlite_context_manger import connect_sqlite, source_columns
+
 
 BATCH_SIZE = 100
 
@@ -114,7 +116,7 @@ class PersonFilmWork:
 
 @pytest.fixture(scope="function")
 def db_connection_sqlite():
-    conn = sqlite3.connect('./sqlite_to_postgres/db.sqlite')
+    conn = connect_sqlite('./sqlite_to_postgres/db.sqlite')
     yield conn
     conn.rollback()
     conn.close()
@@ -167,7 +169,7 @@ class TestLoadedData:
         column_list = ', '.join(columns)
         sqlite_cursor = db_connection_sqlite.cursor()
         pgsql_cursor = db_connection_pgsql.cursor()
-        sqlite_cursor.execute(f"SELECT {column_list.replace('created', 'created_at').replace('modified', 'updated_at')} FROM {table_name} ORDER BY id")
+        sqlite_cursor.execute(f"SELECT {', '.join(source_columns(db_connection_sqlite, table_name, row_dataclass))} FROM {table_name} ORDER BY id")
         pgsql_cursor.execute(f"SELECT {column_list} FROM content.{table_name} ORDER BY id")
         while sqlite_results := sqlite_cursor.fetchmany(BATCH_SIZE):
             pgsql_results = pgsql_cursor.fetchmany(BATCH_SIZE)
@@ -175,3 +177,10 @@ class TestLoadedData:
             pgsql_dataclasses = [row_dataclass(**row_data) for row_data in pgsql_results]
             for sqlite_item, pgsql_item in zip(sqlite_dataclasses, pgsql_dataclasses):
                 assert sqlite_item == pgsql_item
+
+    # Проверка совпадения таблиц по хэшам диапазонов id, при расхождении выводятся конкретные id
+    @pytest.mark.parametrize('table_name', list(tables_for_load.keys()))
+    def test_check_checksums_between_orig_dest(self, table_name, db_connection_sqlite, db_connection_pgsql):
+        checker = ConsistencyChecker(db_connection_sqlite, db_connection_pgsql)
+        diff = checker.check_table(table_name, self.tables_for_load[table_name])
+        assert diff.ok, diff
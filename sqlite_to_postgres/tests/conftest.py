@@ -0,0 +1,31 @@
+import sqlite3
+from contextlib import closing
+
+import pytest
+
+from benchmark import SOURCE_SCHEMA
+
+
+@pytest.fixture
+def make_source(tmp_path):
+    """Файл SQLite со схемой источника, rows - строки по таблицам в виде словарей столбец: значение
+
+    Каждый вызов создаёт новый файл в tmp_path, возвращается путь к нему.
+    """
+    created = []
+
+    def create(rows: dict[str, list[dict]]) -> str:
+        path = tmp_path / f'source_{len(created)}.sqlite'
+        with closing(sqlite3.connect(path)) as sqlite_conn:
+            for ddl in SOURCE_SCHEMA:
+                sqlite_conn.execute(ddl)
+            for table_name, table_rows in rows.items():
+                for row in table_rows:
+                    sqlite_conn.execute(
+                        f'INSERT INTO {table_name} ({", ".join(row)}) VALUES ({", ".join("?" * len(row))})',
+                        tuple(row.values()),
+                    )
+            sqlite_conn.commit()
+        created.append(path)
+        return str(path)
+    return create
@@ -0,0 +1,64 @@
+from contextlib import ExitStack, closing
+
+import pytest
+
+from db_data_classes import Person
+from sqlite_context_manger import MergedSQLiteLoader, connect_sqlite
+
+FIRST_ID = '00000000-0000-4000-8000-000000000001'
+SECOND_ID = '00000000-0000-4000-8000-000000000002'
+THIRD_ID = '00000000-0000-4000-8000-000000000003'
+EARLY = '2021-01-01 00:00:00.000000+00'
+LATE = '2022-01-01 00:00:00.000000+00'
+PERSON_COLUMNS = ('id', 'full_name', 'created_at', 'updated_at')
+
+
+def merged_persons(paths: list[str], batch_size: int = 100) -> list[list[tuple]]:
+    with ExitStack() as stack:
+        connections = [stack.enter_context(closing(connect_sqlite(x))) for x in paths]
+        return list(MergedSQLiteLoader(connections, batch_size).transform_data('person', Person))
+
+
+@pytest.fixture
+def shards(make_source):
+    def create(*shard_rows):
+        return [make_source({'person': [dict(zip(PERSON_COLUMNS, x)) for x in rows]}) for rows in shard_rows]
+    return create
+
+
+# Из повторяющихся id остаётся строка с самым поздним modified, в каком бы файле она ни была
+def test_newest_modified_wins(shards):
+    paths = shards(
+        [(FIRST_ID, 'old', EARLY, EARLY)],
+        [(FIRST_ID, 'new', EARLY, LATE)],
+    )
+    assert [x[1] for x in merged_persons(paths)[0]] == ['new']
+
+
+# При равном modified побеждает файл, указанный раньше
+def test_tie_goes_to_earlier_file(shards):
+    paths = shards(
+        [(FIRST_ID, 'first file', EARLY, LATE)],
+        [(FIRST_ID, 'second file', EARLY, LATE)],
+    )
+    assert [x[1] for x in merged_persons(paths)[0]] == ['first file']
+
+
+# Строка без времени изменения проигрывает датированной даже из более раннего файла
+def test_undated_row_loses(shards):
+    paths = shards(
+        [(FIRST_ID, 'undated', None, None)],
+        [(FIRST_ID, 'dated', EARLY, EARLY)],
+    )
+    assert [x[1] for x in merged_persons(paths)[0]] == ['dated']
+
+
+# Строки всех файлов сливаются по возрастанию id и режутся на пачки заданного размера
+def test_rows_are_merged_in_id_order(shards):
+    paths = shards(
+        [(FIRST_ID, 'a', EARLY, EARLY), (THIRD_ID, 'c', EARLY, EARLY)],
+        [(SECOND_ID, 'b', EARLY, EARLY), (THIRD_ID, 'c', EARLY, EARLY)],
+    )
+    batches = merged_persons(paths, batch_size=2)
+    assert [len(x) for x in batches] == [2, 1]
+    assert [str(y[0]) for x in batches for y in x] == [FIRST_ID, SECOND_ID, THIRD_ID]
@@ -0,0 +1,42 @@
+import threading
+
+import pytest
+
+from sqlite_context_manger import read_ahead
+
+
+# Пачки приходят в исходном порядке
+def test_batches_keep_order():
+    batches = ([x] for x in range(3))
+    assert list(read_ahead(batches, depth=1)) == [[0], [1], [2]]
+
+
+# Ошибка чтения пробрасывается в вызывающий поток после уже прочитанных пачек
+def test_reader_error_is_raised_in_caller():
+    def batches():
+        yield [1]
+        raise ValueError('broken source')
+
+    received = []
+    with pytest.raises(ValueError, match='broken source'):
+        for batch in read_ahead(batches()):
+            received.append(batch)
+    assert received == [[1]]
+
+
+# Если вызывающий прекратил чтение, поток чтения останавливается и закрывает источник
+def test_early_close_stops_reader():
+    closed = threading.Event()
+
+    def batches():
+        try:
+            while True:
+                yield [0]
+        finally:
+            closed.set()
+
+    stream = read_ahead(batches(), depth=1)
+    next(stream)
+    stream.close()
+    assert closed.is_set()
+    assert not [x for x in threading.enumerate() if x.name == 'sqlite-reader']
@@ -0,0 +1,72 @@
+from preflight import PackedIds, id_key, validate_links
+
+FILM_ID = '00000000-0000-4000-8000-000000000001'
+PERSON_ID = '00000000-0000-4000-8000-000000000002'
+MISSING_ID = '00000000-0000-4000-8000-0000000000ff'
+LINK_COLUMNS = ('id', 'film_work_id', 'person_id', 'role', 'created_at')
+
+
+def source_rows(*links: tuple) -> dict[str, list[dict]]:
+    """Один фильм, одна персона и связи между ними в виде кортежей по LINK_COLUMNS"""
+    return {
+        'film_work': [{'id': FILM_ID, 'title': 'Film', 'type': 'movie'}],
+        'person': [{'id': PERSON_ID, 'full_name': 'Person'}],
+        'person_film_work': [dict(zip(LINK_COLUMNS, x)) for x in links],
+    }
+
+
+# Ссылки в никуда, ссылки не в формате uuid и повторы уникального ключа попадают в отчёт
+def test_link_problems_are_reported(make_source):
+    source = make_source(source_rows(
+        ('link-1', FILM_ID, PERSON_ID, 'actor', None),
+        ('link-2', FILM_ID, PERSON_ID, 'actor', None),
+        ('link-3', FILM_ID, MISSING_ID, 'actor', None),
+        ('link-4', 'not-a-uuid', PERSON_ID, 'writer', None),
+    ))
+    (report,) = validate_links([source], ['person_film_work'])
+    assert not report.ok
+    assert report.rows == 4
+    assert report.orphans == {'film_work_id': 0, 'person_id': 1}
+    assert report.orphan_samples == [('link-3', 'person_id', MISSING_ID)]
+    assert report.malformed_samples == [('link-4', 'film_work_id', 'not-a-uuid')]
+    assert report.duplicates == 1
+
+
+# Связи проверяются после слияния файлов: заменённая строка не даёт ни сироты, ни повтора ключа
+def test_links_checked_after_merge(make_source):
+    paths = [
+        make_source(source_rows(
+            ('link-1', FILM_ID, PERSON_ID, 'actor', '2020-01-01 00:00:00'),
+            ('link-3', FILM_ID, MISSING_ID, 'actor', '2020-01-01 00:00:00'),
+            ('link-6', FILM_ID, PERSON_ID, 'writer', '2020-01-01 00:00:00'),
+        )),
+        make_source(source_rows(
+            ('link-1', FILM_ID, PERSON_ID, 'writer', '2021-01-01 00:00:00'),
+            ('link-3', FILM_ID, PERSON_ID, 'director', '2021-01-01 00:00:00'),
+            ('link-5', FILM_ID, PERSON_ID, 'actor', '2021-01-01 00:00:00'),
+        )),
+    ]
+    (report,) = validate_links(paths, ['person_film_work'])
+    assert report.rows == 4
+    assert report.orphans == {'film_work_id': 0, 'person_id': 0}
+    # link-6 повторяет ключ победившей link-1 из другого файла, старая link-1 с ролью actor не считается
+    assert report.duplicates == 1
+    assert report.duplicate_samples == [(FILM_ID, PERSON_ID, 'writer', 2)]
+
+
+def test_id_key_rejects_malformed_ids():
+    assert id_key(FILM_ID) == int(FILM_ID.replace('-', ''), 16)
+    for value in ('not-a-uuid', '1234', 'g' * 32, 42):
+        assert id_key(value) is None
+
+
+# Упакованный массив находит id и при добавлении не по порядку
+def test_packed_ids_lookup():
+    keys = [id_key(x) for x in (PERSON_ID, FILM_ID, PERSON_ID)]
+    ids = PackedIds()
+    for key in keys:
+        ids.add(key)
+    ids.finish()
+    assert len(ids) == 2
+    assert id_key(FILM_ID) in ids and id_key(PERSON_ID) in ids
+    assert id_key(MISSING_ID) not in ids
@@ -0,0 +1,96 @@
+from psycopg import errors as pg_errors
+import pytest
+
+from db_data_classes import Genre
+from metrics import RunMetrics
+from pgsql_context_manager import PostgresSaver
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self._connection = connection
+
+    def execute(self, query, params=None):
+        self._connection.log.append(query)
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    """Соединение, которое только запоминает служебные команды транзакции"""
+
+    def __init__(self):
+        self.log = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def rollback(self):
+        self.log.append('ROLLBACK')
+
+    def commit(self):
+        self.log.append('COMMIT')
+
+
+class FakeQuarantine:
+    def __init__(self):
+        self.rows = []
+
+    def add(self, table_name, row_class, row, error):
+        self.rows.append(row)
+
+
+class FakeWriterSaver(PostgresSaver):
+    """Запись падает с DataError, если в пачке есть строка из bad, записанные пачки запоминаются"""
+
+    def __init__(self, bad, **kwargs):
+        super().__init__(FakeConnection(), **kwargs)
+        self.bad = bad
+        self.written = []
+
+    def _write(self, batch, table_name, row_class):
+        if any(x[0] in self.bad for x in batch):
+            raise pg_errors.DataError('bad row')
+        self.written.extend(batch)
+
+
+def make_batch(size):
+    return [(x, f'genre {x}', None, None, None) for x in range(size)]
+
+
+# Чистая пачка пишется без точек сохранения
+def test_clean_batch_without_savepoint():
+    saver = FakeWriterSaver(set(), quarantine=FakeQuarantine())
+    saver.save_data(make_batch(100), 'genre', Genre)
+    assert len(saver.written) == 100
+    assert saver._connection.log == []
+
+
+@pytest.mark.parametrize('bad', [{0}, {99}, {3, 4, 57}, set(range(0, 100, 10))])
+def test_bisect_quarantines_only_bad_rows(bad):
+    quarantine = FakeQuarantine()
+    metrics = RunMetrics(trace_memory=False)
+    saver = FakeWriterSaver(bad, quarantine=quarantine, metrics=metrics)
+    saver.save_data(make_batch(100), 'genre', Genre)
+
+    assert sorted(x[0] for x in quarantine.rows) == sorted(bad)
+    assert sorted(x[0] for x in saver.written) == [x for x in range(100) if x not in bad]
+    assert metrics.tables['genre'].quarantined == len(bad)
+
+    log = saver._connection.log
+    # Упавшая пачка откатывается целиком, дальше - только точки сохранения
+    assert log[0] == 'ROLLBACK'
+    # Каждая точка сохранения отпускается, в том числе после отката к ней
+    assert log.count('SAVEPOINT save_batch') == log.count('RELEASE SAVEPOINT save_batch')
+    assert log.count('ROLLBACK TO SAVEPOINT save_batch') > 0
+
+
+def test_other_errors_are_raised():
+    class BrokenSaver(FakeWriterSaver):
+        def _write(self, batch, table_name, row_class):
+            raise pg_errors.OperationalError('connection lost')
+
+    saver = BrokenSaver(set(), quarantine=FakeQuarantine())
+    with pytest.raises(pg_errors.OperationalError):
+        saver.save_data(make_batch(10), 'genre', Genre)
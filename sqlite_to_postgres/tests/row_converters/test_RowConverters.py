@@ -0,0 +1,25 @@
+from datetime import datetime, timedelta, timezone
+from uuid import UUID
+
+from psycopg.types.datetime import DatetimeBinaryDumper
+
+from db_data_classes import Person
+from row_converters import get_converter
+
+PERSON_ID = '00000000-0000-4000-8000-000000000001'
+
+
+# Время без смещения считается UTC, иначе бинарный COPY в timestamptz падает с TypeError
+def test_naive_timestamp_becomes_utc():
+    row = get_converter(Person)((PERSON_ID, 'Person', '2021-06-16 20:14:09', None))
+    assert row[0] == UUID(PERSON_ID)
+    assert row[2] == datetime(2021, 6, 16, 20, 14, 9, tzinfo=timezone.utc)
+    assert row[3] is None
+    DatetimeBinaryDumper(datetime).dump(row[2])
+
+
+# Смещение из источника сохраняется
+def test_aware_timestamp_keeps_offset():
+    row = get_converter(Person)((PERSON_ID, 'Person', '2021-06-16 20:14:09+03', '2021-06-16 20:14:09.5+00'))
+    assert row[2].utcoffset() == timedelta(hours=3)
+    assert row[3] == datetime(2021, 6, 16, 20, 14, 9, 500000, tzinfo=timezone.utc)
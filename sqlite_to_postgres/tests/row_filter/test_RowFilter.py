@@ -0,0 +1,62 @@
+import sqlite3
+from contextlib import closing
+
+import pytest
+
+from data_loader import RowFilter
+
+OLD_FILM = '00000000-0000-4000-8000-000000000001'
+NEW_FILM = '00000000-0000-4000-8000-000000000002'
+PERSON_ID = '00000000-0000-4000-8000-000000000003'
+
+
+@pytest.fixture
+def source(make_source):
+    path = make_source({
+        'film_work': [
+            {'id': OLD_FILM, 'title': 'Film', 'type': 'movie', 'updated_at': '2021-01-01'},
+            {'id': NEW_FILM, 'title': 'Film', 'type': 'movie', 'updated_at': '2023-01-01'},
+        ],
+        'person_film_work': [
+            {'id': 'link-old', 'film_work_id': OLD_FILM, 'person_id': PERSON_ID, 'role': 'actor', 'created_at': '2024-01-01'},
+            {'id': 'link-new', 'film_work_id': NEW_FILM, 'person_id': PERSON_ID, 'role': 'actor', 'created_at': '2020-01-01'},
+        ],
+    })
+    with closing(sqlite3.connect(path)) as sqlite_conn:
+        yield sqlite_conn
+
+
+def selected(sqlite_conn: sqlite3.Connection, row_filter: RowFilter, table_name: str) -> list[str]:
+    condition, params = row_filter.condition(table_name)
+    return [x[0] for x in sqlite_conn.execute(f'SELECT id FROM {table_name} WHERE {condition} ORDER BY id', params)]
+
+
+def test_id_range_and_list_conditions():
+    condition, params = RowFilter(id_from='a', id_to='b', ids=['x', 'y']).condition('person')
+    assert condition == 'id >= ? AND id <= ? AND id IN (SELECT value FROM json_each(?))'
+    assert params == ('a', 'b', '["x", "y"]')
+
+
+def test_empty_filter_has_no_condition():
+    assert RowFilter().condition('genre') == ('', ())
+
+
+# Окно изменений в таблице связей идёт по времени создания строки связи
+def test_window_uses_watermark_column(source):
+    row_filter = RowFilter(changed_from='2022-01-01')
+    assert selected(source, row_filter, 'person_film_work') == ['link-old']
+    assert selected(source, row_filter, 'film_work') == [NEW_FILM]
+
+
+# С by_film условия на id и окно применяются к фильму строки связи
+def test_by_film_selects_links_of_chosen_films(source):
+    assert selected(source, RowFilter(ids=[NEW_FILM], by_film=True), 'person_film_work') == ['link-new']
+    assert selected(source, RowFilter(changed_from='2022-01-01', by_film=True), 'person_film_work') == ['link-new']
+    assert selected(source, RowFilter(ids=[NEW_FILM], by_film=True), 'film_work') == [NEW_FILM]
+
+
+# Персоны и жанры не отбираются по фильму, молча вернуть пустой отбор нельзя
+@pytest.mark.parametrize('table_name', ['person', 'genre'])
+def test_by_film_rejects_tables_without_film(table_name):
+    with pytest.raises(ValueError):
+        RowFilter(ids=[NEW_FILM], by_film=True).condition(table_name)